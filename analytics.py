@@ -0,0 +1,211 @@
+"""Batch price analytics over price_history.db and declarative alert rules.
+
+Observations are kept per product_id group as NumPy arrays that grow with every
+sweep; only groups with new rows are recomputed. For each group the price series
+of every product page is forward-filled, so the lowest offer across the group's
+pages is known at every observation, and the metrics below are derived from it:
+
+    low            lowest current available price across the group's pages
+    rolling_min    lowest group price within the rule's window
+    drop_pct       % drop of the current low from the highest group low in the window
+    spread_pct     % between the cheapest and the dearest current available offer
+    all_time_low   current low is below every earlier group low
+
+Rules live in alert_rules.json, e.g.
+
+    [{"name": "Spadek ETB", "groups": ["black bolt elite trainer box"],
+      "metric": "drop_pct", "op": ">=", "value": 15, "window": "7d"},
+     {"metric": "all_time_low", "op": "==", "value": true}]
+
+and fire when they become true for a group, or again when the group's low changes.
+"""
+import json
+import operator
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+METRICS = ("low", "rolling_min", "drop_pct", "spread_pct", "all_time_low")
+OPERATORS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "==": operator.eq}
+DEFAULT_WINDOW = 30 * 86400
+DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_duration(value):
+    """Seconds from a number or a string like "90m", "12h", "7d" """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = DURATION_RE.match(str(value))
+    if not match:
+        raise ValueError(f"nieprawidłowy czas: {value!r}")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+def validate_rules(rules):
+    """List of problems that make alert_rules.json unusable, empty if it is fine"""
+    if not isinstance(rules, list):
+        return ["oczekiwano listy reguł"]
+    errors = []
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            errors.append(f"#{i}: reguła nie jest obiektem")
+            continue
+        if rule.get("metric") not in METRICS:
+            errors.append(f"#{i}: metric musi być jednym z {', '.join(METRICS)}")
+        if rule.get("op", ">=") not in OPERATORS:
+            errors.append(f"#{i}: op musi być jednym z {', '.join(OPERATORS)}")
+        if "value" not in rule:
+            errors.append(f"#{i}: brak pola 'value'")
+        if "window" in rule:
+            try:
+                parse_duration(rule["window"])
+            except ValueError as e:
+                errors.append(f"#{i}: {e}")
+        if "groups" in rule and not isinstance(rule["groups"], list):
+            errors.append(f"#{i}: groups musi być listą product_id")
+    return errors
+
+def load_rules(path):
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    errors = validate_rules(rules)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return rules
+
+def forward_fill(values, valid):
+    """values with every invalid entry replaced by the last valid one before it (NaN if none)"""
+    idx = np.where(valid, np.arange(len(values)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    filled = values[np.maximum(idx, 0)] if len(values) else values.copy()
+    filled[idx < 0] = np.nan
+    return filled
+
+class GroupSeries:
+    """Columnar observations of one product_id; new rows are buffered until needed"""
+
+    def __init__(self):
+        self.ts = np.empty(0)
+        self.page = np.empty(0, dtype=np.int32)  # Index of the (store, url) in PriceAnalytics.pages
+        self.price = np.empty(0)
+        self.available = np.empty(0, dtype=bool)
+        self.buffer = []
+        self.low = None
+
+    def append(self, ts, page, price, available):
+        self.buffer.append((ts, page, price, available))
+
+    def consolidate(self):
+        if not self.buffer:
+            return
+        ts, page, price, available = zip(*self.buffer)
+        self.buffer = []
+        self.low = None
+        self.ts = np.concatenate([self.ts, np.asarray(ts, dtype=float)])
+        self.page = np.concatenate([self.page, np.asarray(page, dtype=np.int32)])
+        self.price = np.concatenate([self.price, np.asarray(price, dtype=float)])
+        self.available = np.concatenate([self.available, np.asarray(available, dtype=bool)])
+        if np.any(np.diff(self.ts) < 0):
+            # Imported or late rows; everything below assumes time order
+            order = np.argsort(self.ts, kind="stable")
+            self.ts, self.page, self.price, self.available = (
+                self.ts[order], self.page[order], self.price[order], self.available[order])
+
+    def group_low(self):
+        """Lowest available price across pages after every observation, and the current offers"""
+        if self.low is None:
+            self.low = self.compute_group_low()
+        return self.low
+
+    def compute_group_low(self):
+        # One column per product page, a store may list the same product under several URLs
+        pages = np.unique(self.page)
+        # Each page's last known offer at every observation; unavailable or unpriced is inf
+        offer = np.where(self.available & ~np.isnan(self.price), self.price, np.inf)
+        matrix = np.empty((len(self.ts), len(pages)))
+        for column, page in enumerate(pages):
+            mine = self.page == page
+            matrix[:, column] = forward_fill(offer, mine)
+        matrix[np.isnan(matrix)] = np.inf  # Page not seen yet
+        low = matrix.min(axis=1)
+        low[np.isinf(low)] = np.nan
+        current = matrix[-1]
+        return low, current[~np.isinf(current)]
+
+    def stats(self, window, now):
+        self.consolidate()
+        if not len(self.ts):
+            return None
+        low, offers = self.group_low()
+        current = low[-1]
+        if np.isnan(current):
+            return {"low": None, "rolling_min": None, "drop_pct": 0.0, "spread_pct": 0.0, "all_time_low": False}
+        recent = low[(self.ts >= now - window) & ~np.isnan(low)]
+        # The run of observations ending now with the same low is "now"; anything before is history
+        differs = np.nonzero(low != current)[0]
+        earlier = low[:differs[-1] + 1] if len(differs) else low[:0]
+        earlier = earlier[~np.isnan(earlier)]
+        window_max = recent.max() if len(recent) else current
+        return {
+            "low": float(current),
+            "rolling_min": float(recent.min()) if len(recent) else float(current),
+            "drop_pct": float(100 * (window_max - current) / window_max) if window_max else 0.0,
+            "spread_pct": float(100 * (offers.max() - offers.min()) / offers.min()) if len(offers) > 1 else 0.0,
+            "all_time_low": bool(len(earlier) and current < earlier.min()),
+        }
+
+class PriceAnalytics:
+    """Incrementally loaded history of every product_id and the alert rules evaluated on it"""
+
+    def __init__(self, db_path, rules):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.rules = rules
+        self.groups = {}
+        self.pages = {}
+        self.last_rowid = 0
+        self.dirty = set()
+        self.fired = {}
+
+    def load_new_rows(self):
+        rows = self.conn.execute(
+            "SELECT rowid, ts, product_id, store, url, price, available FROM prices "
+            "WHERE rowid > ? AND product_id IS NOT NULL ORDER BY rowid",
+            (self.last_rowid,),
+        ).fetchall()
+        for rowid, ts, product_id, store, url, price, available in rows:
+            page = self.pages.setdefault((store, url), len(self.pages))
+            self.groups.setdefault(product_id, GroupSeries()).append(
+                ts, page, np.nan if price is None else price, bool(available))
+            self.dirty.add(product_id)
+        if rows:
+            self.last_rowid = rows[-1][0]
+        return len(rows)
+
+    def evaluate(self, now=None):
+        """Alerts of rules that became true, as dicts with rule, group, metric value and stats"""
+        now = now if now is not None else time.time()
+        self.load_new_rows()
+        groups, self.dirty = self.dirty, set()
+        alerts = []
+        for index, rule in enumerate(self.rules):
+            window = parse_duration(rule.get("window", DEFAULT_WINDOW))
+            compare = OPERATORS[rule.get("op", ">=")]
+            wanted = rule.get("groups")
+            for group in groups:
+                if wanted and group not in wanted:
+                    continue
+                stats = self.groups[group].stats(window, now)
+                value = stats and stats[rule["metric"]]
+                key = (index, group)
+                if value is None or stats["low"] is None or not compare(value, rule["value"]):
+                    self.fired.pop(key, None)
+                    continue
+                if self.fired.get(key) == stats["low"]:
+                    continue  # Already reported at this price
+                self.fired[key] = stats["low"]
+                alerts.append({"rule": rule, "group": group, "value": value, "stats": stats})
+        return alerts
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,376 @@
+"""Offline benchmark of the monitor using recorded store pages.
+
+    python benchmark.py record [--per-store 3]   # download fixtures for every store in selectors.json
+    python benchmark.py run [--repeat 3] [--playwright]
+    python benchmark.py check                     # regression checks on synthetic pages
+
+Recorded pages are replayed by a local HTTP stand-in server, so runs need no
+network access and can be compared between engines and commits.
+"""
+import argparse
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import main
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+
+def record(fixtures_dir, per_store):
+    """Save up to per_store product pages of every configured store"""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    index = []
+    for store in main.SELECTORS:
+        products = [p for p in main.PRODUCTS if p.get("store") == store][:per_store]
+        if not products:
+            print(f"⚠️ Brak produktów dla sklepu {store}")
+            continue
+        os.makedirs(os.path.join(fixtures_dir, store), exist_ok=True)
+        for i, product in enumerate(products):
+            try:
+                resp = requests.get(product["url"], headers={"User-Agent": main.USER_AGENT}, timeout=main.REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                print(f"❌ {product['url']}: {e}")
+                continue
+            filename = os.path.join(store, f"{i}.html")
+            with open(os.path.join(fixtures_dir, filename), "wb") as f:
+                f.write(resp.content)
+            index.append({
+                "store": store,
+                "url": product["url"],
+                "name": product["name"],
+                "product_id": product.get("product_id"),
+                "file": filename,
+                "status": resp.status_code,
+                "content_type": resp.headers.get("Content-Type", "text/html; charset=utf-8"),
+            })
+            print(f"✅ {store}: {product['url']} ({len(resp.content) // 1024} KB, {resp.status_code})")
+    with open(os.path.join(fixtures_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    print(f"📦 Zapisano {len(index)} stron w {fixtures_dir}")
+
+def load_fixtures(fixtures_dir):
+    path = os.path.join(fixtures_dir, "index.json")
+    if not os.path.exists(path):
+        raise SystemExit(f"❌ Brak {path}, uruchom najpierw: python benchmark.py record")
+    with open(path, "r", encoding="utf-8") as f:
+        fixtures = json.load(f)
+    for fixture in fixtures:
+        with open(os.path.join(fixtures_dir, fixture["file"]), "rb") as f:
+            fixture["body"] = f.read()
+        fixture["etag"] = '"' + hashlib.sha1(fixture["body"]).hexdigest() + '"'
+    return fixtures
+
+def start_server(fixtures):
+    """Serve fixtures at /<store>/<n>.html with ETag support; returns (server, base_url)"""
+    by_path = {"/" + fixture["file"].replace(os.sep, "/"): fixture for fixture in fixtures}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            fixture = by_path.get(self.path)
+            if fixture is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            fixture["hits"] = fixture.get("hits", 0) + 1
+            if self.headers.get("If-None-Match") == fixture["etag"]:
+                self.send_response(304)
+                self.send_header("ETag", fixture["etag"])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(fixture["status"])
+            self.send_header("Content-Type", fixture["content_type"])
+            self.send_header("Content-Length", str(len(fixture["body"])))
+            self.send_header("ETag", fixture["etag"])
+            self.end_headers()
+            try:
+                self.wfile.write(fixture["body"])
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The streaming engine hangs up once it has what it needs
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def local_url(base_url, fixture):
+    return f"{base_url}/{fixture['file'].replace(os.sep, '/')}"
+
+def unthrottled_selectors():
+    # All fixtures come from one local server, per-store politeness would only measure sleeps
+    return {store: dict(config, min_interval=0, max_concurrency=main.MAX_CONCURRENT_REQUESTS)
+            for store, config in main.SELECTORS.items()}
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def measure(name, func, repeat):
+    """Run func() repeat times; func returns a list of per-page latencies in seconds.
+    Peak memory comes from one extra traced run, tracemalloc would distort the timings."""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        latencies += func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "pages": len(latencies),
+        "pages_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+def bench_parse(fixtures, repeat):
+    """Median full parse + extraction time per store"""
+    per_store = {}
+    for fixture in fixtures:
+        html = fixture["body"].decode("utf-8", "replace")
+        extractor = main.get_extractor(fixture["store"])
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extractor.parse(html)
+            per_store.setdefault(fixture["store"], []).append(time.perf_counter() - start)
+    return {store: statistics.median(times) * 1000 for store, times in per_store.items()}
+
+def check_page_sync(url, store):
+    """Blocking one-page-at-a-time check, the baseline the async engine is compared with"""
+    resp = requests.get(url, headers={"User-Agent": main.USER_AGENT}, timeout=main.REQUEST_TIMEOUT)
+    if resp.status_code != 200:
+        return None, None
+    return main.evaluate_html(resp.text, store)
+
+def bench_requests_path(fixtures, base_url):
+    latencies = []
+    for fixture in fixtures:
+        if main.SELECTORS.get(fixture["store"], {}).get("use_selenium"):
+            continue
+        start = time.perf_counter()
+        check_page_sync(local_url(base_url, fixture), fixture["store"])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_async_engine(fixtures, base_url, http_cache):
+    async def run(scheduler):
+        async def timed(fixture):
+            start = time.perf_counter()
+            await main.is_available_async(scheduler, local_url(base_url, fixture), fixture["store"], max_retries=1)
+            return time.perf_counter() - start
+        return await asyncio.gather(*(
+            timed(fixture) for fixture in fixtures
+            if not main.SELECTORS.get(fixture["store"], {}).get("use_selenium")
+        ))
+
+    scheduler = main.StoreScheduler(unthrottled_selectors(), http_cache)
+    try:
+        return list(scheduler.run(run(scheduler)))
+    finally:
+        scheduler.close()
+
+def bench_playwright_path(fixtures, base_url):
+    async def run(scheduler, pool):
+        semaphore = asyncio.Semaphore(pool.size)
+
+        async def timed(fixture):
+            async with semaphore:
+                start = time.perf_counter()
+                await main.is_available_playwright_async(
+                    scheduler, pool, local_url(base_url, fixture), fixture["store"], max_retries=1)
+                return time.perf_counter() - start
+        return await asyncio.gather(*(timed(fixture) for fixture in fixtures))
+
+    scheduler = main.StoreScheduler(unthrottled_selectors())
+    pool = main.BrowserPool()
+    try:
+        return list(scheduler.run(run(scheduler, pool)))
+    finally:
+        scheduler.run(pool.close())
+        scheduler.close()
+
+def bench_pipeline(fixtures, base_url, workdir):
+    """Full fetch + apply_results processing with state, history and cache in workdir"""
+    products = [
+        {"name": fixture["name"], "url": local_url(base_url, fixture), "store": fixture["store"],
+         "product_id": fixture.get("product_id")}
+        for fixture in fixtures
+    ]
+    state = main.StateStore(os.path.join(workdir, "notified.json"), os.path.join(workdir, "notified.journal"))
+    http_cache_file = os.path.join(workdir, "http_cache.json")
+    if os.path.exists(http_cache_file):
+        os.remove(http_cache_file)  # Measure a cold sweep every time
+    fetcher = main.LocalFetcher(http_cache_file)
+    fetcher.scheduler.selectors = unthrottled_selectors()
+    try:
+        start = time.perf_counter()
+        plan = main.plan_fetches(products)
+        pages, _ = main.fetch_sweep(fetcher, plan)
+        main.apply_results(plan, pages, state, main.build_target_price_map(products))
+        state.save()
+        fetcher.save()
+        main.get_price_history().flush()
+        elapsed = time.perf_counter() - start
+    finally:
+        fetcher.close()
+        state.close()
+    # Per-page latency isn't observable inside the pipeline, report the sweep average
+    return [elapsed / len(products)] * len(products) if products else []
+
+def run(fixtures_dir, repeat, playwright):
+    fixtures = load_fixtures(fixtures_dir)
+    server, base_url = start_server(fixtures)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+
+    # Never notify anyone or touch the real history from a benchmark
+    main.WEBHOOK_URL = main.WEBHOOK_URL_RISE = main.TELEGRAM_TOKEN = None
+    main.TWILIO_ACCOUNT_SID = None
+    main.price_history = main.PriceHistory(os.path.join(workdir, "price_history.db"))
+    main.play_sound = lambda: None
+
+    print(f"📦 {len(fixtures)} stron z {len(set(f['store'] for f in fixtures))} sklepów, serwer {base_url}\n")
+
+    print("⏱️ Parsowanie (mediana ms na stronę):")
+    for store, ms in sorted(bench_parse(fixtures, repeat).items(), key=lambda item: -item[1]):
+        print(f"  {store:<20} {ms:8.1f}")
+    print()
+
+    results = [
+        measure("requests (sync)", lambda: bench_requests_path(fixtures, base_url), repeat),
+        measure("async (zimny cache)", lambda: bench_async_engine(fixtures, base_url, {}), repeat),
+    ]
+    warm_cache = {}
+    bench_async_engine(fixtures, base_url, warm_cache)
+    results.append(measure("async (ciepły cache)", lambda: bench_async_engine(fixtures, base_url, dict(warm_cache)), repeat))
+    if playwright:
+        results.append(measure("playwright", lambda: bench_playwright_path(fixtures, base_url), repeat))
+    results.append(measure("pipeline (apply_results)", lambda: bench_pipeline(fixtures, base_url, workdir), repeat))
+
+    print(f"{'silnik':<24} {'stron':>6} {'stron/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'pamięć MB':>10}")
+    for result in results:
+        print(f"{result['name']:<24} {result['pages']:>6} {result['pages_per_sec']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['peak_mb']:>10.1f}")
+    if resource is not None:
+        print(f"\nMaks. RSS procesu: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+    main.get_price_history().close()
+    server.shutdown()
+
+def synthetic_fixture(store, body):
+    return {"store": store, "url": "", "name": store, "file": f"{store}/0.html", "status": 200,
+            "content_type": "text/html; charset=utf-8", "body": body.encode("utf-8"),
+            "etag": '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'}
+
+def check_json_ld_change(base_url, fixture):
+    """A price change only in JSON-LD must not be hidden by the cached fingerprint"""
+    def page(price):
+        # The visible price sits past the first streaming checkpoint, so only JSON-LD is read early
+        return ('<html><head><script type="application/ld+json">{"@type": "Product", "offers": '
+                f'{{"price": "{price}", "priceCurrency": "PLN", "availability": "InStock"}}}}</script>'
+                '<script>var nonce = "1";</script></head><body>'
+                + "<p>opis produktu</p>" * 5000 + f'<p class="price">{price.replace(".", ",")} zł</p></body></html>')
+
+    main.update_selectors({fixture["store"]: {"price": ".price"}})
+    fixture.update(synthetic_fixture(fixture["store"], page("95.00")))
+    scheduler = main.StoreScheduler(unthrottled_selectors())
+    try:
+        url = local_url(base_url, fixture)
+        first = scheduler.run(main.is_available_async(scheduler, url, fixture["store"], max_retries=1))
+        fixture.update(synthetic_fixture(fixture["store"], page("90.00")))
+        second = scheduler.run(main.is_available_async(scheduler, url, fixture["store"], max_retries=1))
+    finally:
+        scheduler.close()
+    return first == (True, "95.00 zł") and second == (True, "90.00 zł"), f"{first} -> {second}"
+
+def check_stream_without_discount(base_url, fixture):
+    """A page without the optional discount element stops at the first checkpoint"""
+    store = fixture["store"]
+    main.update_selectors({store: {"price": ".price", "price_discounted": ".promo", "availability": ".add",
+                                   "structured": False}})
+    fixture.update(synthetic_fixture(store, '<html><body><p class="price">120,00 zł</p><button class="add">Do koszyka</button>'
+                                     + "<p>opis produktu</p>" * 15000 + "</body></html>"))
+    extractor = main.get_extractor(store)
+    parses = []
+    build_soup = extractor.build_soup
+    extractor.build_soup = lambda html: parses.append(len(html)) or build_soup(html)
+    scheduler = main.StoreScheduler(unthrottled_selectors())
+    try:
+        result = scheduler.run(main.is_available_async(scheduler, local_url(base_url, fixture), store, max_retries=1))
+    finally:
+        scheduler.close()
+    return result == (True, "120.00 zł") and len(parses) == 1, f"{result}, parsowania: {parses}"
+
+def check_shared_page(base_url, fixture):
+    """A page listed under two stores is downloaded once and evaluated with each store's selectors"""
+    store, alias = fixture["store"], fixture["store"] + "-alias"
+    main.update_selectors({store: {"price": ".price", "structured": False},
+                           alias: {"price": ".promo", "structured": False}})
+    fixture.update(synthetic_fixture(store, '<html><body><p class="price">120,00 zł</p>'
+                                     '<p class="promo">99,00 zł</p><button>Do koszyka</button></body></html>'))
+    url = local_url(base_url, fixture)
+    scheduler = main.StoreScheduler(unthrottled_selectors())
+    try:
+        pages = scheduler.run(main.fetch_pages_async(scheduler, main.BrowserPool(), [(store, url), (alias, url)]))
+    finally:
+        scheduler.close()
+    ok = pages == {(store, url): (True, "120.00 zł"), (alias, url): (True, "99.00 zł")} and fixture.get("hits") == 1
+    return ok, f"{sorted(pages.values())}, pobrań: {fixture.get('hits', 0)}"
+
+def check(checks=(check_json_ld_change, check_stream_without_discount, check_shared_page)):
+    """Run each check against its own synthetic store; exits with 1 if any failed"""
+    fixtures = [synthetic_fixture(f"check{i}", "") for i in range(len(checks))]
+    server, base_url = start_server(fixtures)
+    failed = 0
+    for fixture, func in zip(fixtures, checks):
+        ok, detail = func(base_url, fixture)
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {func.__doc__}: {detail}")
+    server.shutdown()
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark monitora na nagranych stronach sklepów")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="katalog z nagranymi stronami")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="nagraj strony produktów")
+    record_parser.add_argument("--per-store", type=int, default=3, help="liczba stron na sklep")
+    run_parser = subparsers.add_parser("run", help="odtwórz nagrane strony i zmierz wydajność")
+    run_parser.add_argument("--repeat", type=int, default=3, help="liczba powtórzeń każdego testu")
+    run_parser.add_argument("--playwright", action="store_true", help="mierz także ścieżkę Playwright")
+    subparsers.add_parser("check", help="sprawdź regresje cache i parsowania na syntetycznych stronach")
+    args = parser.parse_args()
+
+    main.load_config()
+    if args.command == "record":
+        record(args.fixtures, args.per_store)
+    elif args.command == "check":
+        check()
+    else:
+        run(args.fixtures, args.repeat, args.playwright)
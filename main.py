@@ -1,17 +1,32 @@
 import time
-import requests
-from bs4 import BeautifulSoup
 import datetime
 import platform
 import os
 import json
-from twilio.rest import Client
 import csv
+import sqlite3
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright
 import threading
+import asyncio
+import contextlib
+import hashlib
+import codecs
+import heapq
+import itertools
+import collections
+import math
+import random
+import queue
+import argparse
+import multiprocessing
+import zlib
+import http.server
+import email.utils
+import urllib.parse
+import gc
+import signal
+from multiprocessing.managers import BaseManager
 
 load_dotenv()
 
@@ -25,49 +40,401 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 CHECK_INTERVAL = 120
+# Adaptive scheduling: each product gets its own interval around CHECK_INTERVAL within these bounds
+MIN_CHECK_INTERVAL = 5
+MAX_CHECK_INTERVAL = 900
+VOLATILITY_WINDOW = 6 * 3600  # price/availability changes younger than this make a product "hot"
+STALE_AFTER = 24 * 3600  # sold out without any change for this long is checked less often
+# Products falling due within this many seconds of each other are checked in one sweep
+SWEEP_BATCH_WINDOW = int(os.getenv("SWEEP_BATCH_WINDOW", "5"))
+# Saving state and HTTP cache, price analytics and the sweep summary run at most this often
+PERSIST_INTERVAL = int(os.getenv("PERSIST_INTERVAL", str(CHECK_INTERVAL)))
+# Max number of requests-based product pages fetched concurrently by the async engine
+MAX_CONCURRENT_REQUESTS = 200
+REQUEST_TIMEOUT = 15
+# Per-store politeness defaults, can be overridden with "max_concurrency" / "min_interval" in selectors.json
+STORE_MAX_CONCURRENCY = 4
+STORE_MIN_INTERVAL = 0.5
+# BeautifulSoup tree builder, "lxml" is much faster when installed; can be set per store with "parser"
+DEFAULT_HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
+# Streaming mode: parse the body at growing checkpoints and stop downloading once all selectors matched
+STREAM_PARSE = True
+STREAM_CHUNK_SIZE = 16 * 1024
+STREAM_FIRST_CHECKPOINT = 64 * 1024
+# Warm browser contexts shared by all Playwright checks (also their max concurrency)
+PLAYWRIGHT_CONTEXTS = 4
+# How long to wait for the store's price/availability selector after DOMContentLoaded
+PLAYWRIGHT_SELECTOR_TIMEOUT = 10000
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_URL_RE = re.compile(
+    r"google-analytics\.com|googletagmanager\.com|doubleclick\.net|facebook\.net|connect\.facebook|"
+    r"hotjar\.com|clarity\.ms|tiktok\.com|criteo\.|smartsupp|livechatinc\.com"
+)
+CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor'
+]
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 NOTIFIED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "notified.json")
+# Changed state entries are appended here and folded into NOTIFIED_FILE every JOURNAL_COMPACT_EVERY entries
+NOTIFIED_JOURNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "notified.journal")
+JOURNAL_COMPACT_EVERY = 1000
+PRICE_HISTORY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_history.db")
+# Declarative alerts over the price history, evaluated by analytics.py after every sweep
+ALERT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alert_rules.json")
+# Legacy append-only log, imported into PRICE_HISTORY_DB on first start
+PRICE_HISTORY_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_history.csv")
+# Unchanged observations are stored at most this often
+HISTORY_HEARTBEAT = 3600
+# Notification dispatcher: per-channel queue size, digest window and retry backoff (seconds)
+NOTIFY_QUEUE_SIZE = 1000
+NOTIFY_COALESCE_WINDOW = 2.0
+NOTIFY_MAX_RETRIES = 5
+NOTIFY_RETRY_DELAY = 2.0
+NOTIFY_MAX_RETRY_DELAY = 120.0
+# Per-store circuit breaker: consecutive failures before opening, and the jittered
+# exponential pause (seconds) before a half-open probe is let through
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_BASE_DELAY = 30.0
+BREAKER_MAX_DELAY = 1800.0
+BREAKER_PROBE_TIMEOUT = 120.0
+# Sharded mode: how long the coordinator waits for a batch from its shard workers
+SHARD_RESULT_TIMEOUT = 300
+# Observability: Prometheus-style endpoint on METRICS_PORT (0 = off), LOG_FORMAT=json for structured logs
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HTTP_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_cache.json")
+# Products found on catalog listings that aren't in products.json
+DISCOVERED_PRODUCTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovered_products.json")
+# Fetch keys of catalog listing pages are (store, CATALOG_PREFIX + listing url)
+CATALOG_PREFIX = "catalog:"
+# Listing pages of a catalog store are fetched at most this often, due products in between are resolved from them
+CATALOG_REFRESH = CHECK_INTERVAL
+TRACKING_PARAMS = ("utm_", "trk_", "fbclid", "gclid")
+# Long-running mode: Chromium is relaunched after this many pages, and a process whose RSS (MB) or
+# open handles stay over budget after recycling exits to be restarted by --supervise (0 = no limit)
+BROWSER_RECYCLE_PAGES = int(os.getenv("BROWSER_RECYCLE_PAGES", "500"))
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+HANDLE_BUDGET = int(os.getenv("HANDLE_BUDGET", "0"))
+# Supervisor: a child without a heartbeat for WATCHDOG_TIMEOUT seconds is restarted; crashes
+# are restarted after an exponential pause, reset once the child has run for SUPERVISOR_STABLE_AFTER
+WATCHDOG_TIMEOUT = int(os.getenv("WATCHDOG_TIMEOUT", str(2 * MAX_CHECK_INTERVAL)))
+SUPERVISOR_RESTART_DELAY = 5.0
+SUPERVISOR_MAX_RESTART_DELAY = 300.0
+SUPERVISOR_STABLE_AFTER = 3600
+SUPERVISOR_STOP_TIMEOUT = 30
+# Exit code of a child that stopped itself to be restarted (EX_TEMPFAIL)
+EXIT_RESTART = 75
+
+class Metrics:
+    """Thread-safe labelled counters, gauges and latency histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, dict(h, buckets=list(h["buckets"]))) for key, h in self.histograms.items())
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                lines.append(f"# TYPE {name} counter")
+                previous = name
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name != previous:
+                lines.append(f"# TYPE {name} gauge")
+                previous = name
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name != previous:
+                lines.append(f"# TYPE {name} histogram")
+                previous = name
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{self.format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.gauges.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h["count"], "sum": h["sum"]}
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+METRICS = Metrics()
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = METRICS.render().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(METRICS.snapshot()).encode("utf-8"), "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
 
-# Thread-local storage for Playwright instances
-playwright_storage = threading.local()
-
-def get_playwright_instance():
-    """Get a thread-local Playwright instance"""
-    if not hasattr(playwright_storage, 'playwright'):
-        playwright_storage.playwright = sync_playwright().start()
-        playwright_storage.browser = playwright_storage.playwright.chromium.launch(
-            headless=True,
-            args=[
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--disable-web-security',
-                '--disable-features=VizDisplayCompositor'
-            ]
-        )
-    return playwright_storage.playwright, playwright_storage.browser
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log(f"📈 Metryki: http://127.0.0.1:{server.server_address[1]}/metrics")
+    return server
+
+def log(message, event="log", **fields):
+    """Timestamped console line, or one JSON object per line when LOG_FORMAT=json"""
+    if LOG_FORMAT == "json":
+        record = {"ts": datetime.datetime.now().isoformat(timespec="milliseconds"), "event": event, "message": message}
+        record.update(fields)
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+    else:
+        print(f"[{timestamp()}] {message}")
+
+def should_block_request(request):
+    """Images, fonts, media and analytics never affect price or availability"""
+    return request.resource_type in BLOCKED_RESOURCE_TYPES or bool(BLOCKED_URL_RE.search(request.url))
+
+def playwright_locator(page, selector):
+    if selector.startswith("xpath="):
+        xpath = selector.replace("xpath=", "")
+        return page.locator(f"xpath={xpath}")
+    elif selector.startswith("text="):
+        # Handle text-based selectors
+        text = selector.replace("text=", "")
+        return page.locator(f"text={text}")
+    elif selector.startswith("contains="):
+        # Handle contains-based selectors
+        text = selector.replace("contains=", "")
+        return page.locator(f":has-text('{text}')")
+    # Handles plain CSS and :has-text() selectors directly
+    return page.locator(selector)
+
+def playwright_wait_selector(store):
+    """Selector that shows the product block has rendered"""
+    config = SELECTORS.get(store, {})
+    return config.get("price") or config.get("availability") or config.get("unavailability")
+
+class BrowserPool:
+    """One shared Chromium with a pool of warm contexts that block heavy resources"""
+
+    def __init__(self, size=PLAYWRIGHT_CONTEXTS):
+        self.size = size
+        self.playwright = None
+        self.browser = None
+        self.contexts = None
+        self.lock = None
+        self.pages = 0  # Opened since launch, see recycle_due()
+
+    async def start(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.browser is not None:
+                return
+            await self.launch()
+            self.contexts = asyncio.Queue()
+            for _ in range(self.size):
+                try:
+                    context = await self.new_context()
+                except Exception:
+                    context = None  # Created by whoever borrows the slot
+                self.contexts.put_nowait(context)
+
+    async def launch(self):
+        from playwright.async_api import async_playwright
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+
+    async def new_context(self):
+        async def route_handler(route):
+            if should_block_request(route.request):
+                await route.abort()
+            else:
+                await route.continue_()
+
+        context = await self.browser.new_context(user_agent=USER_AGENT)
+        await context.route("**/*", route_handler)
+        return context
 
-def cleanup_playwright():
-    """Clean up thread-local Playwright resources"""
-    if hasattr(playwright_storage, 'browser'):
+    async def replace_context(self):
+        """Context for a slot that lost its own, relaunching Chromium if it has died"""
+        browser = self.browser
         try:
-            playwright_storage.browser.close()
-        except:
-            pass
-    if hasattr(playwright_storage, 'playwright'):
+            return await self.new_context()
+        except Exception:
+            if browser is not None and browser.is_connected():
+                raise
+        async with self.lock:
+            if self.browser is browser:  # Not relaunched by another borrower meanwhile
+                log("🔁 Chromium przestał działać, uruchamiam go ponownie", event="browser_relaunch")
+                await self.shutdown()
+                await self.launch()
+        return await self.new_context()
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        """Borrow a context from the pool and open a page in it"""
+        if self.browser is None:
+            await self.start()
+        context = await self.contexts.get()
+        self.pages += 1
+        healthy = False
         try:
-            playwright_storage.playwright.stop()
-        except:
-            pass
+            if context is None:
+                context = await self.replace_context()
+            page = await context.new_page()
+            try:
+                yield page
+                healthy = True
+            finally:
+                try:
+                    await page.close()
+                except Exception:
+                    healthy = False
+        finally:
+            try:
+                if not healthy and context is not None:
+                    await context.close()
+            except Exception:
+                pass
+            finally:
+                # The slot always goes back; a broken context is replaced by its next borrower
+                self.contexts.put_nowait(context if healthy else None)
+
+    async def close(self):
+        await self.shutdown()
+        self.pages = 0
+
+    async def shutdown(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+        if self.playwright is not None:
+            try:
+                await self.playwright.stop()
+            except Exception:
+                pass
+        self.browser = None
+        self.playwright = None
+
+    def recycle_due(self):
+        # Chromium's memory only grows with the pages it has rendered; relaunching
+        # between sweeps, when no page is open, is the only reliable way to get it back
+        return self.browser is not None and BROWSER_RECYCLE_PAGES and self.pages >= BROWSER_RECYCLE_PAGES
+
+def resource_usage():
+    """(RSS in bytes, open file handles) of this process, None where it can't be measured"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        process = psutil.Process()
+        handles = process.num_handles() if hasattr(process, "num_handles") else process.num_fds()
+        return process.memory_info().rss, handles
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return rss, len(os.listdir("/proc/self/fd"))
+    except (OSError, ValueError, AttributeError):
+        return None, None  # No psutil and no procfs
+
+def over_budget():
+    """Descriptions of the exceeded MEMORY_BUDGET_MB / HANDLE_BUDGET, empty when within them"""
+    rss, handles = resource_usage()
+    problems = []
+    if rss is not None:
+        METRICS.set("monitor_rss_bytes", rss)
+        if MEMORY_BUDGET_MB and rss > MEMORY_BUDGET_MB * 1024 * 1024:
+            problems.append(f"pamięć {rss // (1024 * 1024)} MB > {MEMORY_BUDGET_MB} MB")
+    if handles is not None:
+        METRICS.set("monitor_open_handles", handles)
+        if HANDLE_BUDGET and handles > HANDLE_BUDGET:
+            problems.append(f"uchwyty {handles} > {HANDLE_BUDGET}")
+    return problems
+
+def config_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
 def load_selectors(filename="selectors.json"):
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
-    with open(path, "r", encoding="utf-8") as f:
+    with open(config_path(filename), "r", encoding="utf-8") as f:
         return json.load(f)
 
 def load_products(filename="products.json"):
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    path = config_path(filename)
     if not os.path.exists(path):
-        print(f"❌ Brak pliku {filename}")
+        log(f"❌ Brak pliku {filename}", event="config_missing", file=filename)
         return []
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
@@ -89,12 +456,18 @@ def build_target_price_map(products):
 
     return pid_to_price
 
-SELECTORS = load_selectors()
-PRODUCTS = load_products()
+# Filled by load_config() on first real use, importing the module stays cheap
+SELECTORS = {}
+PRODUCTS = []
+config_loaded = False
 
-print(f"✅ Załadowano {len(PRODUCTS)} produktów:")
-for p in PRODUCTS:
-    print(f"- {p['name']} ({p['url']})")
+def load_config():
+    """Load selectors.json and products.json into SELECTORS and PRODUCTS once"""
+    global config_loaded
+    if not config_loaded:
+        SELECTORS.update(load_selectors())
+        PRODUCTS[:] = load_products()
+        config_loaded = True
 
 def parse_price(price_str):
     if not price_str:
@@ -106,297 +479,1368 @@ def parse_price(price_str):
     except ValueError:
         return None
 
-def load_notified():
-    if not os.path.exists(NOTIFIED_FILE):
-        with open(NOTIFIED_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f, ensure_ascii=False, indent=2)
+class StateStore:
+    """Last known availability/price per store and product name, shared by worker threads.
+
+    Changes are appended to a journal on save() and periodically compacted into an
+    atomically replaced snapshot, so a crash never loses or truncates the state.
+    """
+
+    def __init__(self, path=NOTIFIED_FILE, journal_path=NOTIFIED_JOURNAL):
+        self.path = path
+        self.journal_path = journal_path
+        self.lock = threading.RLock()
+        self.data = {}
+        self.dirty = {}
+        self.journal_entries = 0
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except json.JSONDecodeError as e:
+                # Keep the broken file for inspection instead of silently dropping all state
+                backup = f"{self.path}.corrupt-{int(time.time())}"
+                os.replace(self.path, backup)
+                log(f"⚠️ Uszkodzony plik {self.path} ({e}), przeniesiono do {backup}")
+                self.data = {}
+
+        if os.path.exists(self.journal_path):
+            valid_bytes = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        break  # Torn last line from a crash mid-append
+                    self.data.setdefault(record["store"], {})[record["name"]] = record["entry"]
+                    self.journal_entries += 1
+                    valid_bytes += len(line)
+            if valid_bytes != os.path.getsize(self.journal_path):
+                # Drop the torn tail so new entries aren't appended after it
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+
+    def get(self, store, name):
+        with self.lock:
+            return dict(self.data.get(store, {}).get(name, {}))
+
+    def set(self, store, name, entry):
+        with self.lock:
+            self.data.setdefault(store, {})[name] = entry
+            self.dirty[(store, name)] = entry
+
+    def update(self, store, name, **fields):
+        with self.lock:
+            entry = self.get(store, name)
+            entry.update(fields)
+            self.set(store, name, entry)
+
+    def save(self):
+        """Append changed entries to the journal, compacting it when it grows too long"""
+        with self.lock, METRICS.timer("monitor_state_save_seconds"):
+            if not self.dirty:
+                return
+            lines = "".join(
+                json.dumps({"store": store, "name": name, "entry": entry}, ensure_ascii=False) + "\n"
+                for (store, name), entry in self.dirty.items()
+            )
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_entries += len(self.dirty)
+            self.dirty.clear()
+            if self.journal_entries >= JOURNAL_COMPACT_EVERY:
+                self.compact()
+
+    def compact(self):
+        """Write a full snapshot via write-and-rename and start a new journal"""
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            # Replaying an old journal over the new snapshot is harmless, so truncating last is safe
+            open(self.journal_path, "w").close()
+            self.journal_entries = 0
+
+    def close(self):
+        self.save()
+        self.compact()
+
+def load_http_cache(path=HTTP_CACHE_FILE):
+    if not os.path.exists(path):
         return {}
     try:
-        with open(NOTIFIED_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
-    except json.JSONDecodeError:
-        with open(NOTIFIED_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f, ensure_ascii=False, indent=2)
+    except (json.JSONDecodeError, OSError):
         return {}
 
-def save_notified(data):
-    with open(NOTIFIED_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def get_price(soup, store):
-    selectors = SELECTORS.get(store, {})
-
-    # 1. Discounted price
-    discounted_selector = selectors.get("price_discounted")
-    if discounted_selector:
-        discounted = soup.select_one(discounted_selector)
-        if discounted:
-            price_text = discounted.get_text(strip=True)
-            match = re.search(r"[\d\s]{1,7}[.,]\d{2}", price_text)
-            if match:
-                try:
-                    price_str = match.group(0).replace(" ", "").replace(",", ".")
-                    value = float(price_str)
-                    return f"{value:.2f} zł"
-                except ValueError:
-                    pass
-
-    # 2. Standard price
-    selector = selectors.get("price", "")
-    if not selector or selector.startswith("xpath="):
-        return "Brak ceny (tylko dla Playwright)"
-
-    price_container = soup.select_one(selector)
-    if not price_container:
-        return "Brak ceny"
-
-    price_text = price_container.get_text(strip=True)
-    match = re.search(r"[\d\s]{1,7}[.,]\d{2}", price_text)
-    if not match:
-        return "Brak ceny"
-
+def save_http_cache(cache, path=HTTP_CACHE_FILE):
+    tmp_path = path + ".tmp"
     try:
-        price_str = match.group(0).replace(" ", "").replace(",", ".")
-        value = float(price_str)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log(f"⚠️ Błąd przy zapisie cache HTTP: {e}")
+
+# Scripts, styles and comments often carry per-request nonces/tokens but are never
+# matched by our price/availability selectors, so they are left out of the fingerprint;
+# JSON-LD blocks stay in, extract_structured() reads the price from them
+VOLATILE_MARKUP_RE = re.compile(r"<!--.*?-->|(<script\b[^>]*>).*?</script>|(<style\b[^>]*>).*?</style>", re.S | re.I)
+
+def strip_volatile(match):
+    tag = match.group(1)
+    if tag and "ld+json" in tag.lower():
+        return match.group(0)
+    return tag or match.group(2) or ""
+
+def selectors_digest(store):
+    return hashlib.sha1(json.dumps(SELECTORS.get(store, {}), sort_keys=True).encode("utf-8")).hexdigest()
+
+def content_fingerprint(html, store):
+    """Hash of the markup our selectors can see, salted with the store's selectors"""
+    stripped = VOLATILE_MARKUP_RE.sub(strip_volatile, html)
+    digest = hashlib.sha1(selectors_digest(store).encode("ascii"))
+    digest.update(stripped.encode("utf-8", "replace"))
+    return digest.hexdigest()
+
+def cached_result(http_cache, key, store):
+    """HTTP cache entry of key, unless it was extracted with other selectors than the store's current ones"""
+    cached = http_cache.get(key)
+    if cached is not None and cached.get("selectors") != selectors_digest(store):
+        return None  # A 304 would otherwise keep serving what the old selectors found
+    return cached
+
+PRICE_RE = re.compile(r"[\d\s]{1,7}[.,]\d{2}")
+UNAVAILABLE_WORDS = ("brak", "wyprzedany", "niedostępny")
+# Page phrases for stores without availability selectors; any unavailable phrase wins
+UNAVAILABLE_PHRASES = (
+    "brak w magazynie", "niedostępny", "wyprzedany", "brak towaru", "chwilowo niedostępny",
+    "out of stock", "sold out", "not available",
+)
+AVAILABLE_PHRASES = ("dodaj do koszyka", "kup teraz", "do koszyka", "add to cart", "buy now", "dostępny", "w magazynie")
+INVISIBLE_TAGS = ("head", "script", "style", "noscript", "template", "svg")
+INVISIBLE_MARKUP_RE = re.compile(
+    r"<!--.*?-->|<(%s)\b[^>]*>.*?</\1\s*>" % "|".join(INVISIBLE_TAGS), re.S | re.I)
+TAG_RE = re.compile(r"<[^>]*>")
+JSON_LD_RE = re.compile(r"""<script[^>]*type=["']?application/ld\+json["']?[^>]*>(.*?)</script>""", re.I | re.S)
+# schema.org availability values under which the product can still be ordered
+SCHEMA_AVAILABLE = ("instock", "limitedavailability", "onlineonly", "instoreonly", "preorder", "presale", "backorder")
+# Platforms with a public per-product JSON endpoint, set with "platform" in selectors.json
+PLATFORMS = ("shopify",)
+# Pseudo-classes whose result depends on markup after the element, unsafe on a truncated page
+STREAM_UNSAFE_SELECTORS = (":last-", ":nth-last-", ":only-", ":has(", ":empty")
+
+def visible_text(html):
+    """Text a visitor can read, without building a tree"""
+    import html as html_module
+    return html_module.unescape(TAG_RE.sub(" ", INVISIBLE_MARKUP_RE.sub(" ", html)))
+
+class AvailabilityClassifier:
+    """Both phrase lists compiled into one alternation, so a page is scanned once"""
+
+    def __init__(self, unavailable=UNAVAILABLE_PHRASES, available=AVAILABLE_PHRASES):
+        self.unavailable = {phrase.lower() for phrase in unavailable}
+        phrases = sorted(self.unavailable | {phrase.lower() for phrase in available}, key=len, reverse=True)
+        # Longest first, so "chwilowo niedostępny" is not reported as "dostępny"
+        self.pattern = re.compile("|".join(re.escape(phrase) for phrase in phrases), re.I) if phrases else None
+
+    def classify(self, text):
+        """False on any unavailable phrase, True if only available ones occur, None if uncertain"""
+        if self.pattern is None:
+            return None
+        found = None
+        for match in self.pattern.finditer(text):
+            if match.group(0).lower() in self.unavailable:
+                return False
+            found = True
+        return found
+
+class StoreExtractor:
+    """Selectors of one store compiled once and evaluated in a single pass over a page"""
+
+    def __init__(self, store, config):
+        self.store = store
+        self.parser = config.get("parser", DEFAULT_HTML_PARSER)
+        price = config.get("price", "")
+        # Playwright-only stores may use xpath= selectors that soupsieve can't handle
+        self.playwright_only_price = not price or price.startswith("xpath=")
+        self.price = None if self.playwright_only_price else self.compile(price)
+        self.price_discounted = self.compile(config.get("price_discounted"))
+        self.availability = self.compile(config.get("availability"))
+        self.unavailability = self.compile(config.get("unavailability"))
+        self.text_region = self.compile(config.get("text_region"))
+        # A store checked by phrases alone (and JSON-LD) never needs the tree
+        self.needs_tree = any(
+            selector is not None
+            for selector in (self.price, self.price_discounted, self.availability, self.unavailability, self.text_region)
+        )
+        self.classifier = AvailabilityClassifier(
+            config.get("unavailable_phrases", UNAVAILABLE_PHRASES), config.get("available_phrases", AVAILABLE_PHRASES))
+        # Early stop needs an availability anchor: an absent unavailability marker only proves
+        # anything at EOF, and the phrase fallback reads the whole page
+        self.streamable = self.availability is not None and config.get("stream", STREAM_PARSE) and not any(
+            token in (config.get(key) or "")
+            for key in ("price", "price_discounted", "availability", "unavailability")
+            for token in STREAM_UNSAFE_SELECTORS
+        )
+        # Embedded JSON-LD is tried before any selector unless the store opts out
+        self.structured = config.get("structured", True)
+        self.platform = config.get("platform")
+        catalog = config.get("catalog") or {}
+        self.catalog = {
+            key: self.compile(catalog.get(key))
+            for key in ("item", "link", "name", "price", "availability", "unavailability")
+        }
+
+    def compile(self, selector):
+        if not selector or selector.startswith(("xpath=", "text=", "contains=")):
+            return None
+        import soupsieve
+        try:
+            return soupsieve.compile(selector)
+        except soupsieve.SelectorSyntaxError as e:
+            log(f"⚠️ Nieprawidłowy selektor dla {self.store} '{selector}': {e}")
+            return None
+
+    @staticmethod
+    def format_price(el):
+        if el is None:
+            return None
+        match = PRICE_RE.search(el.get_text(strip=True))
+        if not match:
+            return None
+        try:
+            value = float(match.group(0).replace(" ", "").replace(",", "."))
+        except ValueError:
+            return None
         return f"{value:.2f} zł"
-    except ValueError:
-        return "Brak ceny"
-
-def is_available(url, store, max_retries=3, retry_delay=5):
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
-    use_playwright = SELECTORS.get(store, {}).get("use_selenium", False)
 
-    for attempt in range(max_retries):
+    def extract_price(self, soup):
+        # 1. Discounted price
+        if self.price_discounted:
+            price = self.format_price(self.price_discounted.select_one(soup))
+            if price:
+                return price
+
+        # 2. Standard price
+        if self.playwright_only_price:
+            return "Brak ceny (tylko dla Playwright)"
+        if not self.price:
+            return "Brak ceny"
+        return self.format_price(self.price.select_one(soup)) or "Brak ceny"
+
+    def extract_availability(self, soup, html=None):
+        if self.unavailability:
+            el = self.unavailability.select_one(soup)
+            if el and any(w in el.get_text(strip=True).lower() for w in UNAVAILABLE_WORDS):
+                return False
+        elif self.availability:
+            if not self.availability.select_one(soup):
+                return False
+        else:
+            return self.classify_text(html, soup) is not False
+        return True  # Default assumption
+
+    def classify_text(self, html=None, soup=None):
+        """Phrase-based availability of the product region (or the whole page), None if uncertain.
+        Without a text_region the raw html is scanned, pass it whenever it is at hand."""
+        if self.text_region is not None:
+            if soup is None:
+                with self.parsed(html) as soup:
+                    return self.classify_text(soup=soup)
+            from bs4 import Comment
+            region = self.text_region.select_one(soup)
+            if region is None:
+                return None
+            text = " ".join(
+                string for string in region.find_all(string=True)
+                if not isinstance(string, Comment) and string.parent.name not in INVISIBLE_TAGS
+            )
+        elif html is not None:
+            text = visible_text(html)
+        else:
+            text = visible_text(str(soup))
+        return self.classifier.classify(text)
+
+    def extract(self, soup, html=None):
+        with METRICS.timer("monitor_extract_seconds", store=self.store):
+            available, price = self.extract_availability(soup, html), self.extract_price(soup)
+        METRICS.inc("monitor_price_match_total", store=self.store, matched=str(price != "Brak ceny").lower())
+        return available, price
+
+    def build_soup(self, html):
+        from bs4 import BeautifulSoup
+        with METRICS.timer("monitor_parse_seconds", store=self.store):
+            return BeautifulSoup(html, self.parser)
+
+    @contextlib.contextmanager
+    def parsed(self, html):
+        """Tree of html that is decomposed afterwards; bs4 trees are reference cycles,
+        left to the garbage collector they pile up between full collections"""
+        soup = self.build_soup(html)
         try:
-            price = "Brak ceny"
+            yield soup
+        finally:
+            soup.decompose()
+
+    def extract_structured(self, html):
+        """(available, price) from a JSON-LD Product block, without building the tree"""
+        if not self.structured or "ld+json" not in html:
+            return None
+        for match in JSON_LD_RE.finditer(html):
+            try:
+                data = json.loads(match.group(1))
+            except ValueError:
+                continue
+            product = find_schema_product(data)
+            result = schema_offer_result(product) if product is not None else None
+            if result is not None:
+                METRICS.inc("monitor_structured_total", store=self.store, source="json_ld")
+                return result
+        return None
+
+    def platform_url(self, url):
+        """Product JSON endpoint of the store's platform for a page URL, or None"""
+        parts = urllib.parse.urlsplit(url)
+        if self.platform == "shopify" and "/products/" in parts.path:
+            return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip("/") + ".js", "", ""))
+        return None
+
+    def parse_platform(self, data):
+        if self.platform == "shopify" and isinstance(data, dict):
+            # /products/<handle>.js: "price" is the cheapest variant in minor units
+            price, available = data.get("price"), data.get("available")
+            if isinstance(price, (int, float)) and isinstance(available, bool):
+                METRICS.inc("monitor_structured_total", store=self.store, source="platform")
+                return available, f"{price / 100:.2f} zł"
+        return None
+
+    def parse_catalog(self, html, base_url):
+        """Products on a listing page as dicts with url, name, available and price"""
+        item_selector, link = self.catalog["item"], self.catalog["link"]
+        if item_selector is None or link is None:
+            return []
+        items = []
+        with self.parsed(html) as soup:
+            for item in item_selector.select(soup):
+                anchor = link.select_one(item)
+                if anchor is None or not anchor.get("href"):
+                    continue
+                name_el = self.catalog["name"].select_one(item) if self.catalog["name"] else anchor
+                price = self.format_price(self.catalog["price"].select_one(item)) if self.catalog["price"] else None
+                if self.catalog["unavailability"]:
+                    available = self.catalog["unavailability"].select_one(item) is None
+                elif self.catalog["availability"]:
+                    available = self.catalog["availability"].select_one(item) is not None
+                else:
+                    available = True  # Default assumption, as on product pages
+                items.append({
+                    "url": urllib.parse.urljoin(base_url, anchor["href"]),
+                    "name": name_el.get_text(" ", strip=True) if name_el is not None else "",
+                    "available": available,
+                    "price": price or "Brak ceny",
+                })
+        return items
+
+    def parse(self, html):
+        result = self.extract_structured(html)
+        if result is not None:
+            return result
+        if not self.needs_tree:
+            return self.extract(None, html)
+        with self.parsed(html) as soup:
+            return self.extract(soup, html)
+
+    def parse_price(self, html):
+        result = self.extract_structured(html)
+        if result is not None:
+            return result[1]
+        with self.parsed(html) as soup:
+            return self.extract_price(soup)
+
+    @staticmethod
+    def is_closed(el):
+        # The parser closes everything still open at the end of a truncated page, so an
+        # element is only complete if something follows it or one of its ancestors
+        node = el
+        while node is not None and node.name != "[document]":
+            if node.next_sibling is not None:
+                return True
+            node = node.parent
+        return False
+
+    def parse_prefix(self, html):
+        """Extract from the beginning of a page, or None if price and availability haven't matched yet"""
+        result = self.extract_structured(html)
+        if result is not None or not self.streamable:
+            return result
+        with self.parsed(html) as soup:
+            # price_discounted and unavailability are missing from most pages by design,
+            # waiting for them would reparse every such page at each checkpoint until EOF
+            for selector in (self.price, self.availability):
+                if selector is None:
+                    continue
+                el = selector.select_one(soup)
+                if el is None or not self.is_closed(el):
+                    return None
+            return self.extract(soup, html)
+
+EXTRACTORS = {}
+
+def find_schema_product(node):
+    """First schema.org Product/ProductGroup in a JSON-LD document, @graph included"""
+    if isinstance(node, list):
+        for item in node:
+            product = find_schema_product(item)
+            if product is not None:
+                return product
+        return None
+    if not isinstance(node, dict):
+        return None
+    types = node.get("@type")
+    types = types if isinstance(types, list) else [types]
+    if "Product" in types or "ProductGroup" in types:
+        return node
+    return find_schema_product(node.get("@graph")) if "@graph" in node else None
+
+def schema_offers(product):
+    offers = product.get("offers")
+    if offers is None and isinstance(product.get("hasVariant"), list):
+        offers = [v.get("offers") for v in product["hasVariant"] if isinstance(v, dict)]
+    pending, flat = [offers], []
+    while pending:
+        offer = pending.pop()
+        if isinstance(offer, list):
+            pending.extend(offer)
+        elif isinstance(offer, dict):
+            if isinstance(offer.get("offers"), (list, dict)):
+                pending.append(offer["offers"])  # AggregateOffer listing its offers
+            else:
+                flat.append(offer)
+    return flat
+
+def schema_price_value(offer):
+    price = offer.get("price", offer.get("lowPrice"))
+    if price is None and isinstance(offer.get("priceSpecification"), dict):
+        price = offer["priceSpecification"].get("price")
+    if isinstance(price, str):
+        price = price.replace(" ", "").replace(",", ".")
+    try:
+        return float(price)
+    except (TypeError, ValueError):
+        return None
 
-            if use_playwright:
+def schema_offer_result(product):
+    """(available, price) from a schema.org Product, None unless both are known in PLN"""
+    candidates = []
+    for offer in schema_offers(product):
+        if offer.get("priceCurrency", "PLN").upper() != "PLN":
+            continue
+        value = schema_price_value(offer)
+        availability = offer.get("availability")
+        if value is None or not isinstance(availability, str):
+            continue
+        candidates.append((availability.rstrip("/").rsplit("/", 1)[-1].lower() in SCHEMA_AVAILABLE, value))
+    if not candidates:
+        return None
+    in_stock = [value for available, value in candidates if available]
+    value = min(in_stock or [value for _, value in candidates])
+    return bool(in_stock), f"{value:.2f} zł"
+
+def get_extractor(store):
+    """Compiled extractor for a store, built on first use"""
+    extractor = EXTRACTORS.get(store)
+    if extractor is None:
+        extractor = StoreExtractor(store, SELECTORS.get(store, {}))
+        EXTRACTORS[store] = extractor
+    return extractor
+
+def evaluate_html(html, store):
+    """Extract (available, price) from a product page fetched without Playwright"""
+    return get_extractor(store).parse(html)
+
+SELECTOR_KEYS = ("price", "price_discounted", "availability", "unavailability", "title", "text_region")
+
+def validate_selectors(selectors):
+    """List of problems that make a selectors.json unusable, empty if it is fine"""
+    import soupsieve
+    if not isinstance(selectors, dict):
+        return ["oczekiwano obiektu {sklep: konfiguracja}"]
+    errors = []
+    for store, config in selectors.items():
+        if not isinstance(config, dict):
+            errors.append(f"{store}: konfiguracja nie jest obiektem")
+            continue
+        for key in SELECTOR_KEYS:
+            selector = config.get(key)
+            if selector is None:
+                continue
+            if not isinstance(selector, str):
+                errors.append(f"{store}.{key}: selektor nie jest tekstem")
+            elif selector and not selector.startswith(("xpath=", "text=", "contains=")):
                 try:
-                    playwright, browser = get_playwright_instance()
-                    context = browser.new_context(
-                        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                    )
-                    page = context.new_page()
-                    
-                    # Set longer timeout and better error handling
-                    page.set_default_timeout(30000)  # 30 seconds
-                    
-                    try:
-                        # Try to load the page with different wait strategies
-                        try:
-                            page.goto(url, wait_until="networkidle", timeout=20000)
-                        except Exception as e:
-                            print(f"[{timestamp()}] ⚠️ networkidle failed, trying domcontentloaded: {e}")
-                            page.goto(url, wait_until="domcontentloaded", timeout=15000)
-                        
-                        # Wait a bit for dynamic content
-                        page.wait_for_timeout(3000)
-                        
-                        html = page.content()
-                        soup = BeautifulSoup(html, "html.parser")
-                        price = get_price(soup, store)
-
-                        availability_selector = SELECTORS.get(store, {}).get("availability", "")
-                        unavailability_selector = SELECTORS.get(store, {}).get("unavailability", "")
-
-                        def try_selector(selector):
-                            try:
-                                if selector.startswith("xpath="):
-                                    xpath = selector.replace("xpath=", "")
-                                    el = page.locator(f"xpath={xpath}")
-                                elif selector.startswith("text="):
-                                    # Handle text-based selectors
-                                    text = selector.replace("text=", "")
-                                    el = page.locator(f"text={text}")
-                                elif selector.startswith("contains="):
-                                    # Handle contains-based selectors
-                                    text = selector.replace("contains=", "")
-                                    el = page.locator(f":has-text('{text}')")
-                                elif ":" in selector and "has-text" in selector:
-                                    # Handle :has-text() selectors directly
-                                    el = page.locator(selector)
-                                else:
-                                    el = page.locator(selector)
-                                return el.count() > 0 and el.first.is_visible()
-                            except Exception as e:
-                                print(f"[{timestamp()}] ⚠️ Błąd selektora '{selector}': {e}")
-                                return False
-
-                        # Check for text-based availability/unavailability
-                        def check_text_availability():
-                            # Common Polish unavailability phrases
-                            unavailable_phrases = [
-                                "brak w magazynie", "niedostępny", "wyprzedany", 
-                                "brak towaru", "chwilowo niedostępny", "out of stock",
-                                "sold out", "not available"
-                            ]
-                            
-                            # Common Polish availability phrases
-                            available_phrases = [
-                                "dodaj do koszyka", "kup teraz", "do koszyka",
-                                "add to cart", "buy now", "dostępny", "w magazynie"
-                            ]
-                            
-                            page_text = page.content().lower()
-                            
-                            # Check for unavailability phrases
-                            for phrase in unavailable_phrases:
-                                if phrase in page_text:
-                                    return False
-                            
-                            # Check for availability phrases
-                            for phrase in available_phrases:
-                                if phrase in page_text:
-                                    return True
-                            
-                            return None  # Uncertain
-                        
-                        available = True  # Default assumption
-                        
-                        if unavailability_selector and try_selector(unavailability_selector):
-                            available = False
-                        elif availability_selector:
-                            available = try_selector(availability_selector)
-                        else:
-                            # Fallback to text-based detection
-                            text_result = check_text_availability()
-                            if text_result is not None:
-                                available = text_result
-
-                        return available, price
-                        
-                    finally:
-                        # Always close context
-                        try:
-                            context.close()
-                        except:
-                            pass
-                            
-                except Exception as e:
-                    print(f"[{timestamp()}] ⚠️ Playwright error for {url}: {e}")
-                    if attempt == max_retries - 1:
-                        # On final attempt, try to cleanup and recreate
-                        cleanup_playwright()
-                    raise
-                    
+                    soupsieve.compile(selector)
+                except soupsieve.SelectorSyntaxError as e:
+                    errors.append(f"{store}.{key}: {str(e).splitlines()[0]}")
+        catalog = config.get("catalog")
+        if catalog is not None:
+            if not isinstance(catalog, dict) or not catalog.get("item") or not catalog.get("link"):
+                errors.append(f"{store}.catalog: wymagane pola 'item' i 'link'")
+            elif not isinstance(catalog.get("urls"), list) or not all(isinstance(u, str) for u in catalog["urls"]):
+                errors.append(f"{store}.catalog.urls: oczekiwano listy adresów")
             else:
-                # Regular requests handling
-                resp = requests.get(url, headers=headers, timeout=15)
-                if resp.status_code == 404:
-                    print(f"[{timestamp()}] ⚠️ Produkt nie znaleziony (404): {url}")
-                    return None, None
+                for key, selector in catalog.items():
+                    if key in ("urls", "discover") or not isinstance(selector, str):
+                        continue
+                    try:
+                        soupsieve.compile(selector)
+                    except soupsieve.SelectorSyntaxError as e:
+                        errors.append(f"{store}.catalog.{key}: {str(e).splitlines()[0]}")
+                if catalog.get("discover"):
+                    try:
+                        re.compile(catalog["discover"])
+                    except re.error as e:
+                        errors.append(f"{store}.catalog.discover: {e}")
+        for key in ("unavailable_phrases", "available_phrases"):
+            if key in config and not (isinstance(config[key], list) and all(isinstance(p, str) and p for p in config[key])):
+                errors.append(f"{store}.{key}: oczekiwano listy niepustych fraz")
+        if config.get("platform") is not None and config["platform"] not in PLATFORMS:
+            errors.append(f"{store}.platform: nieznana platforma, dostępne: {', '.join(PLATFORMS)}")
+        if "max_concurrency" in config and not (
+                isinstance(config["max_concurrency"], int) and not isinstance(config["max_concurrency"], bool)
+                and config["max_concurrency"] >= 1):
+            errors.append(f"{store}.max_concurrency: oczekiwano liczby całkowitej >= 1")
+        if "min_interval" in config and not (
+                isinstance(config["min_interval"], (int, float)) and not isinstance(config["min_interval"], bool)
+                and config["min_interval"] >= 0):
+            errors.append(f"{store}.min_interval: oczekiwano liczby nieujemnej")
+    return errors
+
+def validate_products(products):
+    """List of problems that make a products.json unusable, empty if it is fine"""
+    if not isinstance(products, list):
+        return ["oczekiwano listy produktów"]
+    errors = []
+    for i, product in enumerate(products):
+        if not isinstance(product, dict):
+            errors.append(f"#{i}: produkt nie jest obiektem")
+            continue
+        for key in ("name", "url", "store"):
+            if not isinstance(product.get(key), str) or not product[key]:
+                errors.append(f"#{i}: brak pola '{key}'")
+        if product.get("target_price") is not None and not isinstance(product["target_price"], (int, float)):
+            errors.append(f"#{i}: target_price nie jest liczbą")
+    return errors
+
+def diff_selectors(selectors):
+    """{store: new config or None if removed} for every store whose selectors changed"""
+    return {
+        store: selectors.get(store)
+        for store in set(SELECTORS) | set(selectors)
+        if SELECTORS.get(store) != selectors.get(store)
+    }
+
+def update_selectors(changes):
+    """Apply diff_selectors() output in place and drop the affected compiled extractors"""
+    for store, config in changes.items():
+        if config is None:
+            SELECTORS.pop(store, None)
+        else:
+            SELECTORS[store] = config
+        EXTRACTORS.pop(store, None)
+
+def diff_products(old, new):
+    """(removed, added) products, comparing whole entries so edits are a remove plus an add"""
+    def counts(products):
+        return collections.Counter(json.dumps(p, sort_keys=True, ensure_ascii=False) for p in products)
+    old_counts, new_counts = counts(old), counts(new)
+    removed = [json.loads(p) for p in (old_counts - new_counts).elements()]
+    added = [json.loads(p) for p in (new_counts - old_counts).elements()]
+    return removed, added
+
+class ConfigWatcher:
+    """Notices edits of selectors.json and products.json by their mtime and size.
+
+    poll() returns only contents that parsed and validated; a broken file is reported
+    once and the running configuration is kept until the file changes again.
+    """
+
+    def __init__(self, selectors_file="selectors.json", products_file="products.json"):
+        self.files = {
+            "selectors": (config_path(selectors_file), validate_selectors),
+            "products": (config_path(products_file), validate_products),
+        }
+        self.stamps = {name: self.stamp(path) for name, (path, _) in self.files.items()}
+
+    @staticmethod
+    def stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def poll(self):
+        """{"selectors": ..., "products": ...} with the valid files changed since the last poll"""
+        changed = {}
+        for name, (path, validate) in self.files.items():
+            stamp = self.stamp(path)
+            if stamp is None or stamp == self.stamps[name]:
+                continue
+            self.stamps[name] = stamp
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                log(f"⚠️ Nie można wczytać {os.path.basename(path)}, zostaje poprzednia konfiguracja: {e}")
+                continue
+            errors = validate(data)
+            if errors:
+                log(f"⚠️ Błędy w {os.path.basename(path)}, zostaje poprzednia konfiguracja: {'; '.join(errors[:5])}")
+                continue
+            changed[name] = data
+        return changed
+
+def reload_config(watcher, fetcher, product_scheduler, target_price_map):
+    """Apply changed configuration files between sweeps"""
+    changed = watcher.poll()
+    if "selectors" in changed:
+        changes = diff_selectors(changed["selectors"])
+        if changes:
+            update_selectors(changes)
+            fetcher.reload_selectors(changes)
+            log(f"🔄 Przeładowano selektory sklepów: {', '.join(sorted(changes))}",
+                event="reload", file="selectors", stores=sorted(changes))
+    if "products" in changed:
+        removed, added = diff_products(PRODUCTS, changed["products"])
+        if removed or added:
+            PRODUCTS[:] = changed["products"]
+            target_price_map.clear()
+            target_price_map.update(build_target_price_map(PRODUCTS))
+            for product in removed:
+                product_scheduler.remove(product)
+            for product in added:
+                product_scheduler.add(product)
+            log(f"🔄 Przeładowano produkty: +{len(added)} / -{len(removed)} (razem {len(PRODUCTS)})",
+                event="reload", file="products", added=len(added), removed=len(removed))
+
+class StoreBusy(Exception):
+    """429 or 5xx from a store; retry_after is the server's hint in seconds, if any"""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+class CircuitOpen(Exception):
+    """The store's circuit breaker is open, its products are skipped this sweep"""
+
+def parse_retry_after(header):
+    """Seconds from a Retry-After header given either as a number or an HTTP date"""
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def check_status(status, headers):
+    if status == 429 or status >= 500:
+        raise StoreBusy(status, parse_retry_after(headers.get("Retry-After")))
+
+def backoff_delay(base, attempt, retry_after=None, limit=BREAKER_MAX_DELAY):
+    """Jittered exponential delay, never shorter than the server's Retry-After"""
+    delay = min(base * 2 ** attempt, limit) * random.uniform(1.0, 1.2)
+    return max(delay, retry_after or 0.0)
+
+class CircuitBreaker:
+    """Per-store closed / open / half-open breaker.
+
+    A store opens after BREAKER_FAILURE_THRESHOLD consecutive failures, a 429, a
+    Retry-After hint or a failed probe. While open its checks fail fast with
+    CircuitOpen; once the backoff has passed a single probe is let through and
+    its outcome closes the breaker or opens it again for twice as long.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stores = {}
+
+    def entry(self, store):
+        if store not in self.stores:
+            self.stores[store] = {"state": "closed", "failures": 0, "opens": 0, "until": 0.0}
+        return self.stores[store]
+
+    def allow(self, store):
+        with self.lock:
+            entry = self.entry(store)
+            now = time.monotonic()
+            if entry["state"] == "closed":
+                return True
+            if now < entry["until"]:
+                METRICS.inc("monitor_breaker_skipped_total", store=store)
+                return False
+            # Let one probe through; another one only if it never reported back
+            entry["state"] = "half_open"
+            entry["until"] = now + BREAKER_PROBE_TIMEOUT
+            return True
+
+    def is_open(self, store):
+        with self.lock:
+            entry = self.entry(store)
+            return entry["state"] != "closed" and time.monotonic() < entry["until"]
+
+    def record_success(self, store):
+        with self.lock:
+            entry = self.entry(store)
+            if entry["state"] != "closed":
+                log(f"✅ Sklep {store} znowu odpowiada, wznawiam sprawdzanie", event="breaker", store=store, state="closed")
+                METRICS.inc("monitor_breaker_transitions_total", store=store, state="closed")
+            entry.update(state="closed", failures=0, opens=0, until=0.0)
+
+    def record_failure(self, store, status=None, retry_after=None):
+        with self.lock:
+            entry = self.entry(store)
+            if entry["state"] == "open":
+                return  # Stragglers from before the breaker opened
+            entry["failures"] += 1
+            if not (entry["state"] == "half_open" or status == 429 or retry_after
+                    or entry["failures"] >= BREAKER_FAILURE_THRESHOLD):
+                return
+            delay = backoff_delay(BREAKER_BASE_DELAY, entry["opens"], retry_after)
+            entry.update(state="open", failures=0, opens=entry["opens"] + 1, until=time.monotonic() + delay)
+        log(f"🔌 Sklep {store} nie odpowiada, pomijam jego produkty przez {delay:.0f} s",
+            event="breaker", store=store, state="open", status=status, seconds=round(delay, 1))
+        METRICS.inc("monitor_breaker_transitions_total", store=store, state="open")
+
+class StoreScheduler:
+    """Keeps one keep-alive session per store and spaces out requests to the same shop"""
+
+    def __init__(self, selectors, http_cache=None):
+        self.selectors = selectors
+        self.http_cache = http_cache if http_cache is not None else {}
+        self.loop = asyncio.new_event_loop()
+        self.sessions = {}
+        self.semaphores = {}
+        self.next_slot = {}
+        self.error_rates = {}
+        self.breaker = CircuitBreaker()
+
+    def limits(self, store):
+        config = self.selectors.get(store, {})
+        return (
+            config.get("max_concurrency", STORE_MAX_CONCURRENCY),
+            config.get("min_interval", STORE_MIN_INTERVAL),
+        )
+
+    def session(self, store):
+        if store not in self.sessions:
+            import aiohttp
+            max_concurrency, _ = self.limits(store)
+            connector = aiohttp.TCPConnector(limit=max_concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+            self.sessions[store] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                headers={"User-Agent": USER_AGENT},
+            )
+        return self.sessions[store]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, store):
+        """Wait for a free connection and the store's minimum spacing, then yield its session.
+        Raises CircuitOpen if the store's breaker opened while the check was queued."""
+        max_concurrency, min_interval = self.limits(store)
+        if store not in self.semaphores:
+            self.semaphores[store] = asyncio.Semaphore(max_concurrency)
+        async with self.semaphores[store]:
+            if min_interval > 0:
+                now = self.loop.time()
+                start = max(now, self.next_slot.get(store, 0))
+                self.next_slot[store] = start + min_interval
+                if start > now:
+                    await asyncio.sleep(start - now)
+            # Asked only now: a sweep queues all checks of a store at once, and
+            # those behind the ones that opened the breaker must not go out
+            if not self.breaker.allow(store):
+                raise CircuitOpen(store)
+            yield self.session(store)
+
+    def reset_store(self, store):
+        """Forget the session and limits of a store whose configuration changed"""
+        session = self.sessions.pop(store, None)
+        if session is not None:
+            self.run(session.close())
+        self.semaphores.pop(store, None)
+        self.next_slot.pop(store, None)
+
+    def record_outcome(self, store, ok):
+        """Exponentially weighted share of failed checks per store"""
+        self.error_rates[store] = 0.8 * self.error_rates.get(store, 0.0) + (0.0 if ok else 0.2)
+
+    def error_rate(self, store):
+        return self.error_rates.get(store, 0.0)
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        async def close_sessions():
+            for session in self.sessions.values():
+                await session.close()
+        self.run(close_sessions())
+        self.sessions.clear()
+        self.loop.close()
+
+async def stream_extract(resp, store, cached):
+    """Read a response incrementally and extract (available, price) as early as possible.
+
+    Returns (html_read, fingerprint, available, price). Reading stops at the cached
+    prefix length when its fingerprint is unchanged, or at the first checkpoint where
+    all selectors of the store matched; otherwise the whole page is parsed.
+    """
+    extractor = get_extractor(store)
+    decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+    html = ""
+    cached_length = cached.get("length") if cached and cached.get("fingerprint") else None
+    checkpoint = STREAM_FIRST_CHECKPOINT if extractor.streamable or extractor.structured else None
+
+    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+        html += decoder.decode(chunk)
+
+        if cached_length is not None and len(html) >= cached_length:
+            prefix = html[:cached_length]
+            if content_fingerprint(prefix, store) == cached["fingerprint"]:
+                METRICS.inc("monitor_fingerprint_hits_total", store=store)
+                return prefix, cached["fingerprint"], cached["available"], cached["price"]
+            cached_length = None
+
+        if checkpoint is not None and len(html) >= checkpoint:
+            # Parsing is CPU-bound, keep it off the event loop so other downloads progress
+            result = await asyncio.to_thread(extractor.parse_prefix, html)
+            if result is not None:
+                return (html, content_fingerprint(html, store)) + result
+            checkpoint *= 2
+
+    html += decoder.decode(b"", final=True)
+    fingerprint = content_fingerprint(html, store)
+    if cached_length is not None and cached_length == len(html) and fingerprint == cached["fingerprint"]:
+        return html, fingerprint, cached["available"], cached["price"]
+    available, price = await asyncio.to_thread(extractor.parse, html)
+    return html, fingerprint, available, price
+
+def conditional_headers(cached):
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+async def fetch_platform_json(scheduler, session, url, store):
+    """(available, price) from the platform's product JSON, None to fall back to the page"""
+    extractor = get_extractor(store)
+    endpoint = extractor.platform_url(url)
+    if endpoint is None:
+        return None
+    cached = cached_result(scheduler.http_cache, endpoint, store)
+    async with session.get(endpoint, headers=conditional_headers(cached)) as resp:
+        if resp.status == 304 and cached:
+            return cached["available"], cached["price"]
+        check_status(resp.status, resp.headers)
+        if resp.status != 200:
+            return None
+        try:
+            result = extractor.parse_platform(await resp.json(content_type=None))
+        except ValueError:
+            return None
+        if result is not None:
+            scheduler.http_cache[endpoint] = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "selectors": selectors_digest(store),
+                "available": result[0],
+                "price": result[1],
+            }
+    return result
+
+async def fetch_catalog_async(scheduler, url, store):
+    """Items of one catalog listing page, None if it couldn't be read"""
+    try:
+        async with scheduler.slot(store) as session:
+            start = time.perf_counter()
+            async with session.get(url) as resp:
+                check_status(resp.status, resp.headers)
                 resp.raise_for_status()
+                html = await resp.text(errors="replace")
+        METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+        METRICS.inc("monitor_fetch_total", store=store, outcome="catalog")
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        log(f"⚠️ Błąd listy produktów {url}: {e}", event="fetch_error", store=store, url=url, error=str(e))
+        METRICS.inc("monitor_fetch_total", store=store, outcome="error")
+        scheduler.breaker.record_failure(store, getattr(e, "status", None), getattr(e, "retry_after", None))
+        scheduler.record_outcome(store, False)
+        return None
+    scheduler.breaker.record_success(store)
+    scheduler.record_outcome(store, True)
+    return await asyncio.to_thread(get_extractor(store).parse_catalog, html, url)
+
+async def is_available_async(scheduler, url, store, max_retries=3, retry_delay=5):
+    """Check a page of a store that doesn't need Playwright"""
+    for attempt in range(max_retries):
+        try:
+            cached = cached_result(scheduler.http_cache, url, store)
+            headers = conditional_headers(cached)
+
+            async with scheduler.slot(store) as session:
+                start = time.perf_counter()
+                result = await fetch_platform_json(scheduler, session, url, store)
+                if result is not None:
+                    METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+                    METRICS.inc("monitor_fetch_total", store=store, outcome="ok")
+                    scheduler.record_outcome(store, True)
+                    scheduler.breaker.record_success(store)
+                    return result
+                async with session.get(url, headers=headers) as resp:
+                    if resp.status == 404:
+                        log(f"⚠️ Produkt nie znaleziony (404): {url}", event="not_found", store=store, url=url)
+                        METRICS.inc("monitor_fetch_total", store=store, outcome="not_found")
+                        scheduler.record_outcome(store, True)
+                        scheduler.breaker.record_success(store)
+                        return None, None
+                    if resp.status == 304 and cached:
+                        METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+                        METRICS.inc("monitor_fetch_total", store=store, outcome="not_modified")
+                        scheduler.record_outcome(store, True)
+                        scheduler.breaker.record_success(store)
+                        return cached["available"], cached["price"]
+                    check_status(resp.status, resp.headers)
+                    resp.raise_for_status()
+                    html, fingerprint, available, price = await stream_extract(resp, store, cached)
+                    etag = resp.headers.get("ETag")
+                    last_modified = resp.headers.get("Last-Modified")
+                METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+                METRICS.inc("monitor_fetch_total", store=store, outcome="ok")
+                METRICS.inc("monitor_fetch_bytes_total", len(html), store=store)
+
+            scheduler.http_cache[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "fingerprint": fingerprint,
+                "selectors": selectors_digest(store),
+                "length": len(html),
+                "available": available,
+                "price": price,
+            }
+            scheduler.record_outcome(store, True)
+            scheduler.breaker.record_success(store)
+            return available, price
+
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            if not await handle_fetch_error(scheduler, url, store, e, attempt, max_retries, retry_delay):
+                return False, "Brak ceny"
 
-                soup = BeautifulSoup(resp.text, "html.parser")
-                price = get_price(soup, store)
+    return False, "Brak ceny"
 
-                availability_selector = SELECTORS.get(store, {}).get("availability", "")
-                unavailability_selector = SELECTORS.get(store, {}).get("unavailability", "")
+async def handle_fetch_error(scheduler, url, store, error, attempt, max_retries, retry_delay):
+    """Record a failed attempt and wait before the next one; False once all attempts are used.
+    Raises CircuitOpen when this failure opened the store's breaker."""
+    log(f"⚠️ Błąd przy sprawdzaniu {url} (próba {attempt + 1}/{max_retries}): {error}",
+        event="fetch_error", store=store, url=url, attempt=attempt + 1, error=str(error))
+    METRICS.inc("monitor_fetch_total", store=store, outcome="error")
+    retry_after = getattr(error, "retry_after", None)
+    scheduler.breaker.record_failure(store, getattr(error, "status", None), retry_after)
+    if scheduler.breaker.is_open(store):
+        scheduler.record_outcome(store, False)
+        raise CircuitOpen(store) from error
+    if attempt < max_retries - 1:
+        METRICS.inc("monitor_fetch_retries_total", store=store)
+        delay = backoff_delay(retry_delay, attempt, retry_after)
+        log(f"⏳ Próba ponownego sprawdzenia za {delay:.0f} sekund...")
+        await asyncio.sleep(delay)
+        return True
+    log(f"❌ Maksymalna liczba prób wyczerpana dla {url}")
+    scheduler.record_outcome(store, False)
+    return False
+
+async def is_available_shared_async(scheduler, url, stores, max_retries=3, retry_delay=5):
+    """Check a page listed under several stores with one download and return {store: (available, price)}.
+
+    The request goes through the first store's session, politeness and breaker, and each
+    distinct store config is evaluated on the page. The whole page is read and not put in
+    the HTTP cache, whose entries hold the result of a single store's selectors.
+    """
+    store = stores[0]
+    for attempt in range(max_retries):
+        try:
+            async with scheduler.slot(store) as session:
+                start = time.perf_counter()
+                async with session.get(url) as resp:
+                    if resp.status == 404:
+                        log(f"⚠️ Produkt nie znaleziony (404): {url}", event="not_found", store=store, url=url)
+                        METRICS.inc("monitor_fetch_total", store=store, outcome="not_found")
+                        scheduler.record_outcome(store, True)
+                        scheduler.breaker.record_success(store)
+                        return dict.fromkeys(stores, (None, None))
+                    check_status(resp.status, resp.headers)
+                    resp.raise_for_status()
+                    html = (await resp.read()).decode(resp.charset or "utf-8", errors="replace")
+                METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+                METRICS.inc("monitor_fetch_total", store=store, outcome="ok")
+                METRICS.inc("monitor_fetch_bytes_total", len(html), store=store)
+
+            scheduler.record_outcome(store, True)
+            scheduler.breaker.record_success(store)
+            by_config = {}
+            for other in stores:
+                digest = selectors_digest(other)
+                if digest not in by_config:
+                    by_config[digest] = await asyncio.to_thread(evaluate_html, html, other)
+            return {other: by_config[selectors_digest(other)] for other in stores}
+
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            if not await handle_fetch_error(scheduler, url, store, e, attempt, max_retries, retry_delay):
+                break
+
+    return dict.fromkeys(stores, (False, "Brak ceny"))
+
+async def is_available_playwright_async(scheduler, pool, url, store, max_retries=3, retry_delay=5):
+    """Check a Playwright store using a warm context from the shared browser pool"""
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    availability_selector = SELECTORS.get(store, {}).get("availability", "")
+    unavailability_selector = SELECTORS.get(store, {}).get("unavailability", "")
+    wait_selector = playwright_wait_selector(store)
+
+    async def try_selector(page, selector):
+        try:
+            el = playwright_locator(page, selector)
+            return await el.count() > 0 and await el.first.is_visible()
+        except Exception as e:
+            log(f"⚠️ Błąd selektora '{selector}': {e}")
+            return False
+
+    for attempt in range(max_retries):
+        try:
+            async with scheduler.slot(store), pool.page() as page:
+                start = time.perf_counter()
+                page.set_default_timeout(30000)
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=20000)
+                if response is not None:
+                    check_status(response.status, {"Retry-After": await response.header_value("retry-after")})
+
+                # Wait for the product block instead of a fixed delay
+                if wait_selector:
+                    try:
+                        # Through playwright_locator, contains= isn't a selector engine Playwright knows
+                        await playwright_locator(page, wait_selector).first.wait_for(
+                            state="attached", timeout=PLAYWRIGHT_SELECTOR_TIMEOUT)
+                    except PlaywrightTimeoutError:
+                        log(f"⚠️ Nie znaleziono '{wait_selector}' na {url}")
+
+                html = await page.content()
+                price = await asyncio.to_thread(get_extractor(store).parse_price, html)
 
                 available = True  # Default assumption
-                
-                if unavailability_selector:
-                    el = soup.select_one(unavailability_selector)
-                    if el and any(w in el.get_text(strip=True).lower() for w in ["brak", "wyprzedany", "niedostępny"]):
-                        available = False
+                if unavailability_selector and await try_selector(page, unavailability_selector):
+                    available = False
                 elif availability_selector:
-                    el = soup.select_one(availability_selector)
-                    if not el:
-                        available = False
-
+                    available = await try_selector(page, availability_selector)
+                else:
+                    # Fallback to text-based detection
+                    text_result = await asyncio.to_thread(get_extractor(store).classify_text, html)
+                    if text_result is not None:
+                        available = text_result
+
+                METRICS.observe("monitor_fetch_seconds", time.perf_counter() - start, store=store)
+                METRICS.inc("monitor_fetch_total", store=store, outcome="ok")
+                scheduler.record_outcome(store, True)
+                scheduler.breaker.record_success(store)
                 return available, price
 
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                print(f"[{timestamp()}] ⚠️ Produkt nie istnieje (404): {url}")
-                return None, None
+        except CircuitOpen:
             raise
         except Exception as e:
-            print(f"[{timestamp()}] ⚠️ Błąd przy sprawdzaniu {url} (próba {attempt + 1}/{max_retries}): {e}")
+            log(f"⚠️ Playwright error for {url} (próba {attempt + 1}/{max_retries}): {e}",
+                event="fetch_error", store=store, url=url, attempt=attempt + 1, error=str(e))
+            METRICS.inc("monitor_fetch_total", store=store, outcome="error")
+            retry_after = getattr(e, "retry_after", None)
+            scheduler.breaker.record_failure(store, getattr(e, "status", None), retry_after)
+            if scheduler.breaker.is_open(store):
+                scheduler.record_outcome(store, False)
+                raise CircuitOpen(store) from e
             if attempt < max_retries - 1:
-                print(f"[{timestamp()}] ⏳ Próba ponownego sprawdzenia za {retry_delay} sekund...")
-                time.sleep(retry_delay)
+                METRICS.inc("monitor_fetch_retries_total", store=store)
+                await asyncio.sleep(backoff_delay(retry_delay, attempt, retry_after))
             else:
-                print(f"[{timestamp()}] ❌ Maksymalna liczba prób wyczerpana dla {url}")
+                log(f"❌ Maksymalna liczba prób wyczerpana dla {url}")
+                scheduler.record_outcome(store, False)
                 return False, "Brak ceny"
 
     return False, "Brak ceny"
 
+class NotificationRetry(Exception):
+    """Temporary delivery failure; retry_after is the server's hint in seconds, if any"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def retry_after_hint(response):
+    hint = parse_retry_after(response.headers.get("Retry-After"))
+    if hint is not None:
+        return hint
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    # Discord: {"retry_after": 1.5}, Telegram: {"parameters": {"retry_after": 3}}
+    return body.get("retry_after") or body.get("parameters", {}).get("retry_after")
+
+def post_discord(webhook_url, message):
+    import requests
+    data = {"content": message}
+    try:
+        response = requests.post(webhook_url, json=data, timeout=10)
+    except requests.RequestException as e:
+        raise NotificationRetry(f"Discord: {e}")
+    if response.status_code in [200, 204]:
+        log("✅ Wiadomość wysłana na Discorda.")
+    elif response.status_code == 429 or response.status_code >= 500:
+        raise NotificationRetry(f"Discord: {response.status_code}", retry_after_hint(response))
+    else:
+        log(f"❌ Błąd Discord: {response.status_code} {response.text}")
+
 def send_to_discord_rise(message):
     if not WEBHOOK_URL_RISE:
-        print("⚠️ WEBHOOK_URL nieustawiony")
+        log("⚠️ WEBHOOK_URL nieustawiony")
         return
-    data = {"content": message}
-    try:
-        response = requests.post(WEBHOOK_URL_RISE, json=data, timeout=10)
-        if response.status_code in [200, 204]:
-            print("✅ Wiadomość wysłana na Discorda.")
-        else:
-            print(f"❌ Błąd Discord: {response.status_code} {response.text}")
-    except Exception as e:
-        print(f"❌ Błąd Discord: {e}")
+    post_discord(WEBHOOK_URL_RISE, message)
 
 
 def send_telegram(message):
     if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️ TELEGRAM_TOKEN lub TELEGRAM_CHAT_ID nieustawione")
+        log("⚠️ TELEGRAM_TOKEN lub TELEGRAM_CHAT_ID nieustawione")
         return
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    import requests
     payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "parse_mode": "Markdown"}
     try:
         response = requests.post(url, data=payload, timeout=10)
-        if response.status_code == 200:
-            print("✅ Telegram wysłany")
-        else:
-            print(f"❌ Błąd Telegram: {response.status_code} {response.text}")
-    except Exception as e:
-        print(f"❌ Wyjątek Telegram: {e}")
+    except requests.RequestException as e:
+        raise NotificationRetry(f"Telegram: {e}")
+    if response.status_code == 200:
+        log("✅ Telegram wysłany")
+    elif response.status_code == 429 or response.status_code >= 500:
+        raise NotificationRetry(f"Telegram: {response.status_code}", retry_after_hint(response))
+    else:
+        log(f"❌ Błąd Telegram: {response.status_code} {response.text}")
 
 def send_to_discord(message):
     if not WEBHOOK_URL:
-        print("⚠️ WEBHOOK_URL nieustawiony")
+        log("⚠️ WEBHOOK_URL nieustawiony")
         return
-    data = {"content": message}
-    try:
-        response = requests.post(WEBHOOK_URL, json=data, timeout=10)
-        if response.status_code in [200, 204]:
-            print("✅ Wiadomość wysłana na Discorda.")
-        else:
-            print(f"❌ Błąd Discord: {response.status_code} {response.text}")
-    except Exception as e:
-        print(f"❌ Błąd Discord: {e}")
+    post_discord(WEBHOOK_URL, message)
+
+twilio_client = None
 
 def send_sms(message):
+    global twilio_client
     if not all([TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER, TO_PHONE_NUMBER]):
-        print("⚠️ Twilio credentials nieustawione")
+        log("⚠️ Twilio credentials nieustawione")
         return
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    if twilio_client is None:
+        from twilio.rest import Client
+        twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
     try:
-        sms = client.messages.create(body=message, from_=TWILIO_FROM_NUMBER, to=TO_PHONE_NUMBER)
-        print(f"📱 SMS wysłany! SID: {sms.sid}")
+        sms = twilio_client.messages.create(body=message, from_=TWILIO_FROM_NUMBER, to=TO_PHONE_NUMBER)
+        log(f"📱 SMS wysłany! SID: {sms.sid}")
     except Exception as e:
-        print(f"❌ Błąd SMS: {e}")
+        raise NotificationRetry(f"SMS: {e}")
+
+class NotificationDispatcher:
+    """Delivers notifications from background threads, one worker per channel.
+
+    Messages queued within NOTIFY_COALESCE_WINDOW are merged into digests that fit
+    the channel's length limit. Temporary failures are retried with exponential
+    backoff, honouring the server's retry-after hint. Callers never block: when a
+    channel's queue is full the message is dropped with a warning.
+    """
+
+    def __init__(self, channels):
+        # channels: name -> (send function, max message length or None, min seconds between sends)
+        self.channels = channels
+        self.queues = {name: queue.Queue(maxsize=NOTIFY_QUEUE_SIZE) for name in channels}
+        self.threads = []
+        for name in channels:
+            thread = threading.Thread(target=self.worker, args=(name,), name=f"notify-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, channel, message=""):
+        try:
+            self.queues[channel].put_nowait(message)
+        except queue.Full:
+            METRICS.inc("monitor_notifications_total", channel=channel, outcome="dropped")
+            log(f"⚠️ Kolejka powiadomień '{channel}' pełna, pomijam wiadomość")
+
+    @staticmethod
+    def digests(messages, limit):
+        if limit is None:
+            yield "\n\n".join(messages)
+            return
+        digest = ""
+        for message in messages:
+            message = message[:limit]
+            if digest and len(digest) + 2 + len(message) > limit:
+                yield digest
+                digest = ""
+            digest = f"{digest}\n\n{message}" if digest else message
+        if digest:
+            yield digest
+
+    def worker(self, channel):
+        send, limit, min_interval = self.channels[channel]
+        q = self.queues[channel]
+        last_sent = 0.0
+        stopping = False
+        while not stopping:
+            message = q.get()
+            if message is None:
+                break
+            batch = [message]
+            deadline = time.monotonic() + NOTIFY_COALESCE_WINDOW
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if message is None:
+                    stopping = True
+                    break
+                batch.append(message)
+
+            for digest in self.digests(batch, limit):
+                wait = last_sent + min_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.deliver(channel, send, digest)
+                last_sent = time.monotonic()
+
+    def deliver(self, channel, send, message):
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            try:
+                with METRICS.timer("monitor_notification_seconds", channel=channel):
+                    send(message)
+                METRICS.inc("monitor_notifications_total", channel=channel, outcome="sent")
+                return
+            except NotificationRetry as e:
+                METRICS.inc("monitor_notifications_total", channel=channel, outcome="retry")
+                if attempt == NOTIFY_MAX_RETRIES:
+                    METRICS.inc("monitor_notifications_total", channel=channel, outcome="failed")
+                    log(f"❌ Nie udało się wysłać powiadomienia ({channel}): {e}")
+                    return
+                delay = e.retry_after or min(NOTIFY_RETRY_DELAY * 2 ** attempt, NOTIFY_MAX_RETRY_DELAY)
+                delay *= random.uniform(1.0, 1.2)
+                log(f"⏳ Ponowna próba powiadomienia ({channel}) za {delay:.1f} s: {e}")
+                time.sleep(delay)
+            except Exception as e:
+                METRICS.inc("monitor_notifications_total", channel=channel, outcome="failed")
+                log(f"❌ Błąd powiadomienia ({channel}): {e}")
+                return
+
+    def close(self, timeout=30):
+        """Flush queued notifications before exit"""
+        for q in self.queues.values():
+            try:
+                q.put(None, timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+dispatcher = None
+
+def get_dispatcher():
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = NotificationDispatcher({
+            "discord": (send_to_discord, 2000, 1.0),
+            "discord_rise": (send_to_discord_rise, 2000, 1.0),
+            "telegram": (send_telegram, 4096, 1.0),
+            "sms": (send_sms, 1600, 1.0),
+            # Any number of alerts in one window only needs one beep
+            "sound": (lambda message: play_sound(), None, 0),
+        })
+    return dispatcher
 
 def notify_available(product, price):
-    print(f"[{timestamp()}] ✅ {product['name']} dostępny! Cena: {price}")
+    log(f"✅ {product['name']} dostępny! Cena: {price}")
     discord_message = f"@everyone ✅ Produkt **{product['name']}** dostępny za **{price}**!\n🔗 {product['url']}"
     sms_message = f"{product['name']} za {price}. Link: {product['url']}"
-    send_to_discord(discord_message)
-    send_telegram(sms_message)
-    play_sound()
+    get_dispatcher().send("discord", discord_message)
+    get_dispatcher().send("telegram", sms_message)
+    get_dispatcher().send("sound")
+
+def notify_new_product(product, available, price):
+    log(f"🆕 Nowy produkt w {product['store']}: {product['name']} ({price}) {product['url']}",
+        event="discovered", store=product["store"], url=product["url"])
+    state = "dostępny" if available else "niedostępny"
+    msg = f"🆕 Nowy produkt w **{product['store']}**: **{product['name']}** ({state}, {price})\n🔗 {product['url']}"
+    get_dispatcher().send("discord", msg)
+    get_dispatcher().send("telegram", msg)
+
+def notify_rule_alert(alert):
+    rule, stats = alert["rule"], alert["stats"]
+    name = rule.get("name") or f"{rule['metric']} {rule.get('op', '>=')} {rule['value']}"
+    log(f"📐 {name}: {alert['group']} — najniższa cena {stats['low']:.2f} zł",
+        event="rule_alert", rule=name, group=alert["group"], value=alert["value"], **stats)
+    msg = (
+        f"📐 **{name}** dla **{alert['group']}**\n"
+        f"Najniższa cena: {stats['low']:.2f} zł (min. w oknie: {stats['rolling_min']:.2f} zł, "
+        f"spadek: {stats['drop_pct']:.1f}%, rozrzut: {stats['spread_pct']:.1f}%"
+        f"{', najniższa w historii' if stats['all_time_low'] else ''})"
+    )
+    get_dispatcher().send("discord", msg)
+    get_dispatcher().send("telegram", msg)
 
 def notify_unavailable(product):
-    print(f"[{timestamp()}] ❌ {product['name']} niedostępny.")
+    log(f"❌ {product['name']} niedostępny.")
 
 def notify_price_change(product, old_price, new_price):
-    print(f"[{timestamp()}] 💸 Cena spadła dla {product['name']}! {old_price} → {new_price}")
+    log(f"💸 Cena spadła dla {product['name']}! {old_price} → {new_price}")
     msg = (
         f"@everyone 💸 Cena SPADŁA dla **{product['name']}**!\n"
         f"Stara cena: {old_price}\nNowa cena: {new_price}\n"
         f"{product['url']}"
     )
-    send_to_discord(msg)
-    send_telegram(msg)
+    get_dispatcher().send("discord", msg)
+    get_dispatcher().send("telegram", msg)
 
 def notify_price_increase(product, old_price, new_price):
     target_price = product.get("target_price")
@@ -404,13 +1848,13 @@ def notify_price_increase(product, old_price, new_price):
     if target_price is not None and new_val is not None and new_val > target_price:
         return  # Nie wysyłaj powiadomienia, jeśli cena przekracza target
 
-    print(f"[{timestamp()}] 🔺 Cena wzrosła dla {product['name']}! {old_price} → {new_price}")
+    log(f"🔺 Cena wzrosła dla {product['name']}! {old_price} → {new_price}")
     msg = (
         f" Cena WZROSŁA dla **{product['name']}**!\n"
         f"Stara cena: {old_price}\nNowa cena: {new_price}\n"
         f"{product['url']}"
     )
-    send_to_discord_rise(msg)
+    get_dispatcher().send("discord_rise", msg)
 
 def play_sound():
     try:
@@ -423,135 +1867,983 @@ def play_sound():
         else:
             os.system("echo -e '\a'")
     except Exception as e:
-        print(f"⚠️ Nie udało się odtworzyć dźwięku: {e}")
+        log(f"⚠️ Nie udało się odtworzyć dźwięku: {e}")
 
 def timestamp():
     return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def log_price_history(product, old_price, new_price):
-    log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_history.csv")
-    first_write = not os.path.exists(log_file)
+class PriceHistory:
+    """SQLite price history with float prices, written in one batch per sweep.
+
+    An observation is stored when price or availability changed, or when the last
+    stored one for the same page is older than HISTORY_HEARTBEAT.
+    """
+
+    def __init__(self, path=PRICE_HISTORY_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS prices (
+                ts REAL NOT NULL,
+                product_id TEXT,
+                store TEXT NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                price REAL,
+                available INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS prices_product_ts ON prices (product_id, ts);
+            CREATE INDEX IF NOT EXISTS prices_store_ts ON prices (store, ts);
+            CREATE INDEX IF NOT EXISTS prices_url_ts ON prices (url, ts);
+        """)
+        self.import_csv()
+
+    def import_csv(self, csv_path=PRICE_HISTORY_CSV):
+        """One-off migration of the old price_history.csv into an empty database"""
+        if not os.path.exists(csv_path) or self.conn.execute("SELECT 1 FROM prices LIMIT 1").fetchone():
+            return
+        by_url = {p["url"]: p for p in PRODUCTS}
+        rows = []
+        try:
+            with open(csv_path, "r", encoding="utf-8", newline='') as f:
+                for row in csv.DictReader(f):
+                    product = by_url.get(row["url"], {})
+                    ts = datetime.datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+                    rows.append((ts, product.get("product_id"), product.get("store", "unknown"),
+                                 row["product_name"], row["url"], parse_price(row["new_price"]), 1))
+        except (OSError, KeyError, ValueError) as e:
+            log(f"⚠️ Błąd przy imporcie {csv_path}: {e}")
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        log(f"✅ Zaimportowano {len(rows)} wpisów historii cen z {csv_path}")
+
+    def record(self, product, available, price, ts=None):
+        ts = ts if ts is not None else time.time()
+        value = parse_price(price)
+        key = (product.get("store", "unknown"), product["url"], product.get("product_id"))
+        with self.lock:
+            last = self.last.get(key)
+            if last is not None and last[1:] == (available, value) and ts - last[0] < HISTORY_HEARTBEAT:
+                return
+            self.last[key] = (ts, available, value)
+            self.pending.append((ts, product.get("product_id"), key[0], product["name"], product["url"],
+                                 value, None if available is None else int(bool(available))))
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, []
+            if not rows:
+                return
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                log(f"⚠️ Błąd przy zapisie historii cen: {e}")
+                self.pending = rows + self.pending
+
+    def query(self, sql, params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def min_max(self, product_id, since=None, until=None):
+        """(min, max) price of a product_id, optionally within a time range"""
+        return self.query(
+            "SELECT MIN(price), MAX(price) FROM prices WHERE product_id = ? AND ts >= ? AND ts <= ?",
+            (product_id, since or 0, until or float("inf")),
+        )[0]
+
+    def last_n(self, product_id, n=10, store=None):
+        """Newest n observations of a product_id (optionally one store), newest first"""
+        if store is None:
+            return self.query(
+                "SELECT ts, store, price, available, url FROM prices WHERE product_id = ? ORDER BY ts DESC LIMIT ?",
+                (product_id, n),
+            )
+        return self.query(
+            "SELECT ts, store, price, available, url FROM prices WHERE product_id = ? AND store = ? ORDER BY ts DESC LIMIT ?",
+            (product_id, store, n),
+        )
+
+    def between(self, product_id, start, end):
+        """Observations of a product_id with start <= ts <= end, oldest first"""
+        return self.query(
+            "SELECT ts, store, price, available, url FROM prices WHERE product_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (product_id, start, end),
+        )
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+price_history = None
+
+def get_price_history():
+    global price_history
+    if price_history is None:
+        price_history = PriceHistory()
+    return price_history
+
+def load_analytics(rules_file=ALERT_RULES_FILE, db_path=PRICE_HISTORY_DB):
+    """PriceAnalytics for the configured alert rules, None when there are none"""
+    if not os.path.exists(rules_file):
+        return None
     try:
-        with open(log_file, "a", encoding="utf-8", newline='') as f:
-            writer = csv.writer(f)
-            if first_write:
-                writer.writerow(["timestamp", "product_name", "old_price", "new_price", "url"])
-            writer.writerow([timestamp(), product['name'], old_price, new_price, product['url']])
-    except Exception as e:
-        print(f"⚠️ Błąd przy zapisie historii cen: {e}")
+        import analytics  # NumPy is only needed by deployments with alert rules
+        rules = analytics.load_rules(rules_file)
+    except ImportError as e:
+        log(f"⚠️ Reguły alertów wymagają numpy: {e}")
+        return None
+    except (OSError, ValueError) as e:
+        log(f"⚠️ Nieprawidłowy plik {os.path.basename(rules_file)}: {e}")
+        return None
+    log(f"📐 Załadowano {len(rules)} reguł alertów cenowych")
+    return analytics.PriceAnalytics(db_path, rules)
 
-def check_product(product, notified, group_target_price=None):
+def process_result(product, state, available, price, group_target_price=None):
+    """Compare a fresh (available, price) result with the stored state and notify"""
     try:
         store = product.get("store", "unknown")
         name = product["name"]
 
-        if store not in notified:
-            notified[store] = {}
-
-        available, price = is_available(product["url"], store)
-
         if available is None and price is None:
-            print(f"[{timestamp()}] ⚠️ Pomijanie produktu '{name}' — brak strony.")
+            log(f"⚠️ Pomijanie produktu '{name}' — brak strony.")
             return  # Pomijamy produkt
 
-        previous_entry = notified[store].get(name, {})
-        last_state = previous_entry.get("available")
-        old_price = previous_entry.get("price")
+        get_price_history().record(product, available, price)
 
         current_price_value = parse_price(price)
         target_price = group_target_price or product.get("target_price")
+        notifications = []
 
-        if available and last_state != True:
-            notified[store][name] = {"available": True, "price": price, "timestamp": timestamp()}
-            if target_price is None or (current_price_value is not None and current_price_value <= target_price):
-                notify_available(product, price)
-            if old_price and price != old_price:
+        # Decide under the state lock so concurrent workers see consistent transitions,
+        # but send notifications after releasing it
+        with state.lock:
+            previous_entry = state.get(store, name)
+            last_state = previous_entry.get("available")
+            old_price = previous_entry.get("price")
+
+            if available and last_state != True:
+                state.set(store, name, {"available": True, "price": price, "timestamp": timestamp()})
+                if target_price is None or (current_price_value is not None and current_price_value <= target_price):
+                    notifications.append((notify_available, (product, price)))
+
+            elif not available and last_state != False:
+                notifications.append((notify_unavailable, (product,)))
+                state.set(store, name, {"available": False, "price": price, "timestamp": timestamp()})
+
+            elif available and price and old_price and price != old_price:
                 old_val = parse_price(old_price)
                 new_val = current_price_value
                 if old_val is not None and new_val is not None:
-                    log_price_history(product, old_price, price)
-
-        elif not available and last_state != False:
-            notify_unavailable(product)
-            notified[store][name] = {"available": False, "price": price, "timestamp": timestamp()}
-
-        elif available and price and old_price and price != old_price:
-            old_val = parse_price(old_price)
-            new_val = current_price_value
-            if old_val is not None and new_val is not None:
-                if new_val < old_val:
-                    if target_price is None or new_val <= target_price:
-                        notify_price_change(product, old_price, price)
-                elif new_val > old_val:
-                    notify_price_increase(product, old_price, price)
-                log_price_history(product, old_price, price)
-                notified[store][name]["price"] = price
-                notified[store][name]["timestamp"] = timestamp()
+                    if new_val < old_val:
+                        if target_price is None or new_val <= target_price:
+                            notifications.append((notify_price_change, (product, old_price, price)))
+                    elif new_val > old_val:
+                        notifications.append((notify_price_increase, (product, old_price, price)))
+                    state.update(store, name, price=price, timestamp=timestamp())
+
+        for notify, args in notifications:
+            notify(*args)
 
     except Exception as e:
-        print(f"[{timestamp()}] ⚠️ Błąd przy {product['name']}: {e}")
+        log(f"⚠️ Błąd przy {product['name']}: {e}")
+
+def fetch_key(product):
+    return (product.get("store", "unknown"), product["url"])
+
+def plan_fetches(products):
+    """Group products by (store, url), each store's products are evaluated with its own selectors.
+    A URL listed under several stores is still downloaded once, see shared_pages()."""
+    plan = {}
+    for product in products:
+        plan.setdefault(fetch_key(product), []).append(product)
+    return plan
+
+def shared_pages(keys):
+    """{url: stores} of the product pages several requests-based stores list, e.g. one shop under two names"""
+    stores = {}
+    for store, url in keys:
+        config = SELECTORS.get(store, {})
+        # Playwright, platform JSON and listing fetches depend on the store, those stay one per key
+        if not url.startswith(CATALOG_PREFIX) and not config.get("use_selenium") and not config.get("platform"):
+            stores.setdefault(url, []).append(store)
+    return {url: sorted(group) for url, group in stores.items() if len(group) > 1}
+
+async def fetch_pages_async(scheduler, pool, keys, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """Check every (store, url) once; returns {key: (available, price)} with None for
+    failed checks. A page shared by several stores is downloaded once for all of them.
+    Playwright pages are limited to one per pooled browser context."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    playwright_semaphore = asyncio.Semaphore(pool.size)
+
+    async def fetch(key):
+        store, url = key
+        use_playwright = SELECTORS.get(store, {}).get("use_selenium", False)
+        async with (playwright_semaphore if use_playwright else semaphore):
+            try:
+                if url.startswith(CATALOG_PREFIX):
+                    return key, await fetch_catalog_async(scheduler, url[len(CATALOG_PREFIX):], store)
+                if use_playwright:
+                    return key, await is_available_playwright_async(scheduler, pool, url, store)
+                return key, await is_available_async(scheduler, url, store)
+            except CircuitOpen:
+                return key, None  # The breaker already logged why the store is skipped
+            except Exception as e:
+                log(f"⚠️ Błąd przy {url}: {e}")
+                return key, None
+
+    pages = {}
+
+    async def fetch_shared(url, stores):
+        async with semaphore:
+            try:
+                results = await is_available_shared_async(scheduler, url, stores)
+            except CircuitOpen:
+                results = dict.fromkeys(stores)
+            except Exception as e:
+                log(f"⚠️ Błąd przy {url}: {e}")
+                results = dict.fromkeys(stores)
+        pages.update(((store, url), result) for store, result in results.items())
+
+    shared = shared_pages(keys)
+    fetched = await asyncio.gather(
+        *(fetch(key) for key in keys if key[1] not in shared),
+        *(fetch_shared(url, stores) for url, stores in shared.items()),
+    )
+    pages.update(pair for pair in fetched if pair is not None)
+    return pages
+
+def clean_url(url):
+    """URL without its fragment and tracking parameters"""
+    parts = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode([
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    ])
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+def normalize_url(url):
+    """Comparable form of a product URL, also ignoring scheme, www. and a trailing slash"""
+    parts = urllib.parse.urlsplit(clean_url(url))
+    netloc = parts.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return urllib.parse.urlunsplit(("", netloc, parts.path.rstrip("/"), parts.query, ""))
+
+def name_tokens(text):
+    return set(re.findall(r"\w+", (text or "").lower()))
+
+def catalog_keys(plan):
+    """Listing page fetch keys of every catalog store with products due in this sweep"""
+    keys = []
+    for store in sorted({store for store, _ in plan}):
+        config = SELECTORS.get(store, {})
+        if config.get("catalog") and not config.get("use_selenium"):
+            keys.extend((store, CATALOG_PREFIX + url) for url in config["catalog"].get("urls", []))
+    return keys
+
+def catalog_items(listings):
+    """{store: [items]} from the fetched listing pages"""
+    by_store = {}
+    for (store, _), items in listings.items():
+        if items:
+            by_store.setdefault(store, []).extend(items)
+    return by_store
+
+def resolve_catalog(plan, listings):
+    """{key: (available, price)} for planned pages found on their store's listings,
+    matched by URL or, failing that, by a single item whose name has every product_id word"""
+    resolved = {}
+    for store, items in catalog_items(listings).items():
+        by_url = {normalize_url(item["url"]): item for item in items}
+        for key, group in plan.items():
+            if key[0] != store:
+                continue
+            item = by_url.get(normalize_url(key[1]))
+            if item is None:
+                pid_tokens = name_tokens(group[0].get("product_id"))
+                matches = [i for i in items if pid_tokens and pid_tokens <= name_tokens(i["name"])]
+                item = matches[0] if len(matches) == 1 else None
+            if item is not None:
+                resolved[key] = (item["available"], item["price"])
+    return resolved
+
+class ListingCache:
+    """Parsed listing pages of each catalog store, refetched once they are CATALOG_REFRESH old
+    or the store's selectors changed, so frequent sweeps don't refetch them every time"""
+
+    def __init__(self, max_age=CATALOG_REFRESH):
+        self.max_age = max_age
+        self.stores = {}  # store -> (fetched at, selectors digest, {key: items})
+
+    def stale_keys(self, plan, now):
+        keys = []
+        for key in catalog_keys(plan):
+            entry = self.stores.get(key[0])
+            if entry is None or now - entry[0] >= self.max_age or entry[1] != selectors_digest(key[0]):
+                keys.append(key)
+        return keys
+
+    def update(self, keys, listings, now):
+        # Failed listings are not retried before max_age either, their products are fetched one by one
+        for store in {store for store, _ in keys}:
+            fresh = {key: items for key, items in listings.items() if key[0] == store}
+            self.stores[store] = (now, selectors_digest(store), fresh)
+
+    def listings(self):
+        return {key: items for _, _, listings in self.stores.values() for key, items in listings.items()}
+
+def fetch_sweep(fetcher, plan, listing_cache=None):
+    """Fetch a sweep's pages; products of catalog stores are resolved from the store's
+    listing pages first and only the ones missing there are fetched one by one.
+    Returns (pages, listings), listings being only the ones fetched in this sweep."""
+    listing_cache = listing_cache if listing_cache is not None else ListingCache()
+    listings = {}
+    now = time.time()
+    keys = listing_cache.stale_keys(plan, now)
+    if keys:
+        listings = {key: items for key, items in fetcher.fetch(keys).items() if items is not None}
+        listing_cache.update(keys, listings, now)
+    pages = resolve_catalog(plan, listing_cache.listings())
+    if keys:
+        log(f"📚 Listy produktów: {len(listings)}/{len(keys)}, rozpoznane strony: {len(pages)}",
+            event="catalog", listings=len(listings), resolved=len(pages))
+    remaining = [key for key in plan if key not in pages]
+    if remaining:
+        pages.update(fetcher.fetch(remaining))
+    return pages, listings
+
+class ProductDiscovery:
+    """New products found on catalog listings, kept in DISCOVERED_PRODUCTS_FILE.
+
+    A listing item is new when its name matches the store's catalog "discover" regex
+    and no products.json entry or earlier discovery has its URL or claims it by product_id.
+    """
+
+    def __init__(self, path=DISCOVERED_PRODUCTS_FILE):
+        self.path = path
+        self.products = []
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.products = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                log(f"⚠️ Nie można wczytać {path}: {e}")
+
+    def discover(self, listings):
+        known = {normalize_url(p["url"]) for p in PRODUCTS + self.products}
+        found = []
+        for store, items in catalog_items(listings).items():
+            pattern = SELECTORS.get(store, {}).get("catalog", {}).get("discover")
+            if not pattern:
+                continue
+            claimed = [name_tokens(p.get("product_id")) for p in PRODUCTS if p.get("store") == store]
+            claimed = [tokens for tokens in claimed if tokens]
+            for item in items:
+                url = normalize_url(item["url"])
+                if url in known or not re.search(pattern, item["name"], re.I):
+                    continue
+                tokens = name_tokens(item["name"])
+                if any(pid_tokens <= tokens for pid_tokens in claimed):
+                    continue
+                known.add(url)
+                product = {"name": item["name"], "url": clean_url(item["url"]), "store": store, "discovered": True}
+                found.append(product)
+                notify_new_product(product, item["available"], item["price"])
+        if found:
+            self.products.extend(found)
+            self.save()
+        return found
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.products, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log(f"⚠️ Błąd przy zapisie odkrytych produktów: {e}")
+
+def apply_results(plan, pages, state, target_price_map):
+    """Process fetched pages for every product on them and return a list of
+    (product, available, price); both are None when the check failed"""
+    results = []
+    for key, group in plan.items():
+        page = pages.get(key)
+        for product in group:
+            if page is None:
+                results.append((product, None, None))
+                continue
+            available, price = page
+            process_result(product, state, available, price, target_price_map.get(product.get("product_id")))
+            results.append((product, available, price))
+    return results
+
+class LocalFetcher:
+    """Fetches pages in this process on the store scheduler's event loop"""
+
+    def __init__(self, http_cache_file=HTTP_CACHE_FILE):
+        self.http_cache_file = http_cache_file
+        self.scheduler = StoreScheduler(SELECTORS, load_http_cache(http_cache_file))
+        self.pool = BrowserPool()
+
+    def fetch(self, keys):
+        pages = self.scheduler.run(fetch_pages_async(self.scheduler, self.pool, keys))
+        if self.pool.recycle_due():
+            log(f"♻️ Restart Chromium po {self.pool.pages} stronach", event="browser_recycle", pages=self.pool.pages)
+            self.recycle()
+        return pages
+
+    def recycle(self):
+        """Close the browser; it is relaunched on the next Playwright page"""
+        self.scheduler.run(self.pool.close())
+
+    def error_rate(self, store):
+        return self.scheduler.error_rate(store)
+
+    def reload_selectors(self, changes):
+        # SELECTORS is shared with the scheduler, only per-store connection state needs resetting
+        for store in changes:
+            self.scheduler.reset_store(store)
+
+    def save(self):
+        save_http_cache(self.scheduler.http_cache, self.http_cache_file)
+
+    def close(self):
+        self.save()
+        self.scheduler.run(self.pool.close())
+        self.scheduler.close()
+
+class ShardServerManager(BaseManager):
+    pass
+
+class ShardClientManager(BaseManager):
+    pass
+
+ShardClientManager.register("get_task_queue")
+ShardClientManager.register("get_result_queue")
+
+class ShardCluster:
+    """Coordinator of the sharded mode, with the same interface as LocalFetcher.
+
+    Pages are partitioned by store across shard workers, so each store's politeness
+    limits are still enforced by a single process. Workers are local processes or
+    other machines running "--worker HOST:PORT --shard I"; they only fetch and
+    parse, while state, history and notifications stay in the coordinator.
+    """
+
+    def __init__(self, shards, address=("127.0.0.1", 0), authkey=None, local_workers=True):
+        self.shards = shards
+        self.authkey = authkey or os.urandom(16)
+        self.task_queues = [queue.Queue() for _ in range(shards)]
+        self.result_queue = queue.Queue()
+        self.error_rates = {}
+        self.batch_ids = itertools.count()
+
+        ShardServerManager.register("get_task_queue", callable=lambda shard: self.task_queues[shard])
+        ShardServerManager.register("get_result_queue", callable=lambda: self.result_queue)
+        self.server = ShardServerManager(address=address, authkey=self.authkey).get_server()
+        self.address = self.server.address
+        threading.Thread(target=self.server.serve_forever, name="shard-coordinator", daemon=True).start()
+        log(f"🧩 Koordynator shardów nasłuchuje na {self.address[0]}:{self.address[1]} ({shards} shardów)")
+
+        self.processes = {}
+        self.local_workers = local_workers
+        if local_workers:
+            for shard in range(shards):
+                self.start_worker(shard)
+
+    def start_worker(self, shard):
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_shard_worker, args=(self.address, self.authkey, shard),
+            name=f"shard-{shard}", daemon=True,
+        )
+        process.start()
+        self.processes[shard] = process
+
+    def shard_of(self, store):
+        return zlib.crc32(store.encode("utf-8")) % self.shards
+
+    def fetch(self, keys):
+        batch_id = next(self.batch_ids)
+        by_shard = {}
+        # A shared page goes to its first store's shard, which downloads it once for every store
+        owners = {url: stores[0] for url, stores in shared_pages(keys).items()}
+        for key in keys:
+            by_shard.setdefault(self.shard_of(owners.get(key[1], key[0])), []).append(key)
+        for shard, shard_keys in by_shard.items():
+            self.task_queues[shard].put((batch_id, shard_keys))
+
+        pages = {}
+        waiting = set(by_shard)
+        deadline = time.monotonic() + SHARD_RESULT_TIMEOUT
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log(f"⚠️ Brak odpowiedzi od shardów {sorted(waiting)}")
+                break
+            try:
+                result_batch, shard, shard_pages, error_rates = self.result_queue.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if result_batch != batch_id:
+                continue  # Late answer to a batch that already timed out
+            pages.update(shard_pages)
+            self.error_rates.update(error_rates)
+            waiting.discard(shard)
+
+        if self.local_workers:
+            for shard, process in list(self.processes.items()):
+                if not process.is_alive():
+                    log(f"🔁 Restart procesu shardu {shard}")
+                    self.start_worker(shard)
+        return pages
+
+    def error_rate(self, store):
+        return self.error_rates.get(store, 0.0)
+
+    def reload_selectors(self, changes):
+        # Workers read the files only at startup, so pass the changed stores along
+        for task_queue in self.task_queues:
+            task_queue.put(("selectors", changes))
+
+    def recycle(self):
+        pass  # Workers recycle their own browsers
+
+    def save(self):
+        pass  # Workers save their own HTTP caches
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for process in self.processes.values():
+            process.join(30)
+            if process.is_alive():
+                process.terminate()
+
+def run_shard_worker(address, authkey, shard):
+    """Fetch pages for one shard until the coordinator sends None"""
+    load_config()
+    manager = ShardClientManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    tasks = manager.get_task_queue(shard)
+    results = manager.get_result_queue()
+    fetcher = LocalFetcher(os.path.join(os.path.dirname(os.path.abspath(__file__)), f"http_cache.shard{shard}.json"))
+    log(f"🧩 Shard {shard} połączony z {address[0]}:{address[1]}")
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[0] == "selectors":
+                update_selectors(task[1])
+                fetcher.reload_selectors(task[1])
+                continue
+            batch_id, keys = task
+            pages = fetcher.fetch(keys)
+            results.put((batch_id, shard, pages, dict(fetcher.scheduler.error_rates)))
+            fetcher.save()
+            problems = enforce_budgets(fetcher)
+            if problems:
+                # Restarts are up to the coordinator's supervisor, a shard only sheds what it can
+                log(f"⚠️ Shard {shard} ponad budżetem zasobów: {', '.join(problems)}", event="over_budget", shard=shard)
+    except (KeyboardInterrupt, EOFError, ConnectionError):
+        pass
+    finally:
+        fetcher.close()
 
-def main():
-    notified = load_notified()
+def group_best_prices(products, state):
+    """Cheapest available offer per product_id from the latest known state"""
+    best = {}
+    for product in products:
+        pid = product.get("product_id")
+        if not pid:
+            continue
+        entry = state.get(product.get("store", "unknown"), product["name"])
+        if not entry.get("available"):
+            continue
+        value = parse_price(entry.get("price"))
+        if value is None:
+            continue
+        if pid not in best or value < best[pid][0]:
+            best[pid] = (value, product)
+    return best
+
+def report_group_best_prices(products, state, reported):
+    """Print the cheapest offer of every product_id group whose best offer changed"""
+    for pid, (value, product) in sorted(group_best_prices(products, state).items()):
+        offer = (value, product["url"])
+        if reported.get(pid) == offer:
+            continue
+        reported[pid] = offer
+        log(f"🏷️ Najtańsza oferta '{pid}': {value:.2f} zł w {product.get('store', 'unknown')} ({product['url']})")
+
+class ProductScheduler:
+    """Priority queue of products ordered by their next check time.
+
+    Each product's interval starts at CHECK_INTERVAL and shrinks for products whose
+    price/availability changed recently or whose price is close to the target, and
+    grows for long sold out products and stores that keep failing. Intervals are
+    scaled so the total check rate stays within the budget of the old fixed sweep.
+    """
+
+    def __init__(self, products, target_price_map, error_rate=None):
+        self.target_price_map = target_price_map
+        self.error_rate = error_rate or (lambda store: 0.0)
+        self.heap = []
+        self.counter = itertools.count()
+        self.products = {}
+        self.pending = {}
+        self.intervals = {}
+        self.changes = {}
+        self.last = {}
+        self.rate = 0.0
+        self.budget = 1 / CHECK_INTERVAL
+        now = time.time()
+        for product in products:
+            self.add(product, now)
+
+    def add(self, product, when=None):
+        # Products sharing a page are scheduled together as one entry
+        key = fetch_key(product)
+        if key in self.products:
+            self.products[key].append(product)
+            return
+        self.products[key] = [product]
+        self.budget = len(self.products) / CHECK_INTERVAL
+        self.set_interval(key, CHECK_INTERVAL)
+        self.push(key, when if when is not None else time.time())
+
+    def remove(self, product):
+        key = fetch_key(product)
+        group = self.products.get(key)
+        if not group or product not in group:
+            return
+        group.remove(product)
+        if group:
+            return
+        # Last product on the page: drop the entry, its heap item goes stale
+        del self.products[key]
+        self.pending.pop(key, None)
+        self.rate -= 1 / self.intervals.pop(key)
+        self.changes.pop(key, None)
+        self.last.pop(key, None)
+        self.budget = max(len(self.products), 1) / CHECK_INTERVAL
+
+    def push(self, key, when):
+        # Older heap entries of the same key become stale and are skipped when popped
+        seq = next(self.counter)
+        self.pending[key] = seq
+        heapq.heappush(self.heap, (when, seq, key))
+
+    def set_interval(self, key, interval):
+        if key in self.intervals:
+            self.rate -= 1 / self.intervals[key]
+        self.intervals[key] = interval
+        self.rate += 1 / interval
+
+    def pop_due(self, now=None):
+        now = now if now is not None else time.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self.heap)
+            if self.pending.get(key) == seq:
+                del self.pending[key]
+                due.extend(self.products[key])
+        return due
+
+    def seconds_until_next(self, now=None):
+        while self.heap and self.pending.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return CHECK_INTERVAL
+        now = now if now is not None else time.time()
+        return max(0.0, self.heap[0][0] - now)
+
+    def record(self, product, available, price, now=None):
+        """Store a check result and schedule the product's next check"""
+        key = fetch_key(product)
+        if key not in self.products or key in self.pending:
+            return
+        now = now if now is not None else time.time()
+
+        if available is not None or price is not None:
+            last = self.last.get(key)
+            if last is None or (last[0], last[1]) != (available, price):
+                if last is not None:
+                    self.changes.setdefault(key, collections.deque(maxlen=20)).append(now)
+                self.last[key] = (available, price, now)
+
+        interval = self.compute_interval(key, now)
+        self.set_interval(key, interval)
+        self.push(key, now + interval)
+
+    def compute_interval(self, key, now):
+        interval = float(CHECK_INTERVAL)
+
+        # Every recent change halves the interval
+        recent = sum(1 for t in self.changes.get(key, ()) if now - t <= VOLATILITY_WINDOW)
+        interval /= 2 ** min(recent, 5)
+
+        last = self.last.get(key)
+        if last is not None:
+            available, price, since = last
+            if not available and now - since > STALE_AFTER:
+                interval *= 3
+            targets = [
+                self.target_price_map.get(p.get("product_id")) or p.get("target_price")
+                for p in self.products[key]
+            ]
+            target_price = max((t for t in targets if t), default=None)
+            value = parse_price(price)
+            if target_price and value:
+                ratio = value / target_price
+                if ratio <= 1.05:
+                    interval /= 4
+                elif ratio <= 1.25:
+                    interval /= 2
+                elif ratio >= 2:
+                    interval *= 2
+
+        interval *= 1 + 3 * self.error_rate(key[0])
+
+        # Stretch the interval when the projected check rate exceeds the budget
+        projected = self.rate - 1 / self.intervals.get(key, CHECK_INTERVAL) + 1 / interval
+        if projected > self.budget:
+            interval *= projected / self.budget
+
+        # Spread products with equal intervals so they don't come due in bursts, within the bounds
+        interval *= random.uniform(0.9, 1.1)
+        return min(max(interval, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL)
+
+def enforce_budgets(fetcher):
+    """Recycle the browsers and collect garbage when over budget; returns what is still exceeded"""
+    problems = over_budget()
+    if problems:
+        fetcher.recycle()
+        gc.collect()
+        problems = over_budget()
+    return problems
+
+def beat(heartbeat):
+    if heartbeat is not None:
+        heartbeat.value = time.time()
+
+def main(shards=0, listen=("127.0.0.1", 0), authkey=None, remote=False, once=False, heartbeat=None):
+    """Monitor until interrupted. Under supervise(), heartbeat is updated at least every second
+    while waiting, and True is returned when the process should be restarted."""
+    load_config()
+    state = StateStore()
     selenium_products = [p for p in PRODUCTS if SELECTORS.get(p["store"], {}).get("use_selenium")]
     simple_products = [p for p in PRODUCTS if not SELECTORS.get(p["store"], {}).get("use_selenium")]
     target_price_map = build_target_price_map(PRODUCTS)
 
-    print(f"📊 Produkty wymagające Playwright: {len(selenium_products)}")
-    print(f"📊 Produkty używające requests: {len(simple_products)}")
+    log(f"✅ Załadowano {len(PRODUCTS)} produktów")
+    log(f"📊 Produkty wymagające Playwright: {len(selenium_products)}")
+    log(f"📊 Produkty używające requests: {len(simple_products)}")
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    fetcher = ShardCluster(shards, listen, authkey, local_workers=not remote) if shards else LocalFetcher()
+    product_scheduler = ProductScheduler(PRODUCTS, target_price_map, fetcher.error_rate)
+    reported_best_prices = {}
+    watcher = ConfigWatcher()
+    discovery = ProductDiscovery()
+    listing_cache = ListingCache()
+    price_analytics = load_analytics()
+    for product in discovery.products:
+        product_scheduler.add(product)
+    restart = False
+    # Sweeps since the last save/report, summarised in one log line every PERSIST_INTERVAL
+    totals = collections.Counter()
+    last_persist = -PERSIST_INTERVAL  # The first sweep is saved and reported right away
 
     try:
-        # Use fewer threads for Playwright products to avoid resource conflicts
-        playwright_max_workers = min(2, len(selenium_products)) if selenium_products else 1
-        requests_max_workers = min(5, len(simple_products)) if simple_products else 1
-        
         while True:
-            print(f"\n[{timestamp()}] 🔍 Sprawdzanie produktów...\n")
-            
-            # Process requests-based products first (they're faster and more reliable)
-            if simple_products:
-                print(f"[{timestamp()}] 📡 Sprawdzanie {len(simple_products)} produktów (requests)...")
-                with ThreadPoolExecutor(max_workers=requests_max_workers) as executor:
-                    futures = [
-                        executor.submit(check_product, p, notified, target_price_map.get(p.get("product_id")))
-                        for p in simple_products
-                    ]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            print(f"[{timestamp()}] ⚠️ Błąd w wątku requests: {e}")
-
-            # Process Playwright products with more limited concurrency
-            if selenium_products:
-                print(f"[{timestamp()}] 🎭 Sprawdzanie {len(selenium_products)} produktów (Playwright)...")
-                with ThreadPoolExecutor(max_workers=playwright_max_workers) as executor:
-                    futures = [
-                        executor.submit(check_product, p, notified, target_price_map.get(p.get("product_id")))
-                        for p in selenium_products
-                    ]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            print(f"[{timestamp()}] ⚠️ Błąd w wątku Playwright: {e}")
-
-            save_notified(notified)
-
-            print(f"\n[{timestamp()}] ⏳ Następne sprawdzenie za {CHECK_INTERVAL} sekund...\n")
-            for remaining in range(CHECK_INTERVAL, 0, -1):
-                print(f"\r[{timestamp()}] ⏳ Odliczanie: {remaining} sekund ", end="", flush=True)
-                time.sleep(1)
-            print()
+            beat(heartbeat)
+            reload_config(watcher, fetcher, product_scheduler, target_price_map)
+            due = product_scheduler.pop_due(time.time() + SWEEP_BATCH_WINDOW)
+            if due:
+                sweep_start = time.perf_counter()
+                plan = plan_fetches(due)
+                pages, listings = fetch_sweep(fetcher, plan, listing_cache)
+                results = apply_results(plan, pages, state, target_price_map)
+
+                for product, available, price in results:
+                    product_scheduler.record(product, available, price)
+                for product in discovery.discover(listings):
+                    product_scheduler.add(product)
+
+                sweep_seconds = time.perf_counter() - sweep_start
+                METRICS.observe("monitor_sweep_seconds", sweep_seconds)
+                METRICS.inc("monitor_sweep_pages_total", len(plan))
+                totals.update(
+                    sweeps=1, products=len(due), pages=len(plan),
+                    playwright=sum(1 for store, _ in plan if SELECTORS.get(store, {}).get("use_selenium")),
+                    failed=sum(1 for page in pages.values() if page is None), seconds=sweep_seconds,
+                )
+
+            persisted = False
+            persist_in = last_persist + PERSIST_INTERVAL - time.monotonic()
+            if totals and (once or persist_in <= 0):
+                report_group_best_prices(PRODUCTS, state, reported_best_prices)
+                state.save()
+                fetcher.save()
+                get_price_history().flush()
+                if price_analytics is not None:
+                    with METRICS.timer("monitor_analytics_seconds"):
+                        for alert in price_analytics.evaluate():
+                            notify_rule_alert(alert)
+
+                log(f"✅ Sprawdzono {totals['pages']} stron ({totals['products']} produktów, "
+                    f"🎭 Playwright: {totals['playwright']}) w {totals['sweeps']} przebiegach, "
+                    f"{totals['seconds']:.1f} s (błędy: {totals['failed']})",
+                    event="sweep", sweeps=totals["sweeps"], pages=totals["pages"], products=totals["products"],
+                    playwright=totals["playwright"], failed=totals["failed"], seconds=round(totals["seconds"], 3))
+                totals.clear()
+                last_persist = time.monotonic()
+                persisted = True
+
+            if due:
+                problems = enforce_budgets(fetcher)
+                if problems:
+                    log(f"♻️ Przekroczony budżet zasobów: {', '.join(problems)}", event="over_budget", problems=problems)
+                    if heartbeat is not None:
+                        restart = True  # State is saved on the way out, the supervisor starts a fresh process
+                        break
+
+            if once:
+                break
+
+            wait = product_scheduler.seconds_until_next()
+            if totals:  # Don't hold unsaved results past PERSIST_INTERVAL while nothing is due
+                wait = min(wait, max(0.0, persist_in))
+            wait = math.ceil(wait)
+            # No countdown in JSON mode (one object per line) nor between the batches of one summary period
+            if wait > 0 and (LOG_FORMAT == "json" or not persisted):
+                for _ in range(wait):
+                    beat(heartbeat)
+                    time.sleep(1)
+            elif wait > 0:
+                print(f"\n[{timestamp()}] ⏳ Następne sprawdzenie za {wait} sekund...\n")
+                for remaining in range(wait, 0, -1):
+                    print(f"\r[{timestamp()}] ⏳ Odliczanie: {remaining} sekund ", end="", flush=True)
+                    beat(heartbeat)
+                    time.sleep(1)
+                print()
             
     except KeyboardInterrupt:
-        print(f"\n[{timestamp()}] 🛑 Zatrzymywanie monitorowania...")
+        log("🛑 Zatrzymywanie monitorowania...")
     finally:
-        # Clean up any remaining Playwright resources
-        cleanup_playwright()
-        print(f"[{timestamp()}] ✅ Zamknięto wszystkie zasoby.")
+        # Clean up the browser pool, store sessions and shard workers
+        fetcher.close()
+        get_price_history().close()
+        if price_analytics is not None:
+            price_analytics.close()
+        state.close()
+        if dispatcher is not None:
+            dispatcher.close()
+        log("✅ Zamknięto wszystkie zasoby.")
+    return restart
+
+def run_supervised(heartbeat, kwargs):
+    """Child process of supervise()"""
+    # Only the supervisor stops us: Ctrl+C is left to it, and its SIGTERM goes through main()'s cleanup
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if main(heartbeat=heartbeat, **kwargs):
+        raise SystemExit(EXIT_RESTART)
+
+def stop_process(process):
+    process.terminate()
+    process.join(SUPERVISOR_STOP_TIMEOUT)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+def supervise(**kwargs):
+    """Run main() in a child process and start a fresh one when it goes over budget, crashes
+    (OOM killer included) or stops beating. Notification state, HTTP cache and price history
+    are on disk, so a restarted child carries on where the previous one stopped."""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    context = multiprocessing.get_context("spawn")
+    heartbeat = context.Value("d", time.time(), lock=False)
+    failures = 0
+    process = None
+    try:
+        while True:
+            heartbeat.value = time.time()
+            process = context.Process(target=run_supervised, args=(heartbeat, kwargs), name="monitor")
+            started = time.monotonic()
+            process.start()
+            hung = False
+            while process.is_alive():
+                process.join(1)
+                if process.is_alive() and time.time() - heartbeat.value > WATCHDOG_TIMEOUT:
+                    log(f"🐕 Monitor nie odpowiada od {WATCHDOG_TIMEOUT} s, zatrzymywanie", event="watchdog", pid=process.pid)
+                    hung = True
+                    stop_process(process)
+            if process.exitcode == 0 and not hung:
+                return  # Stopped on purpose (Ctrl+C, --check-once)
+            # Back off on quick repeats too, e.g. a budget the process exceeds right after start
+            if time.monotonic() - started > SUPERVISOR_STABLE_AFTER:
+                failures = 0
+            delay = min(SUPERVISOR_RESTART_DELAY * 2 ** failures, SUPERVISOR_MAX_RESTART_DELAY)
+            failures += 1
+            if process.exitcode == EXIT_RESTART:
+                log(f"♻️ Restart monitora po przekroczeniu budżetu zasobów za {delay:.0f} s", event="restart", reason="budget")
+            else:
+                log(f"🔁 Monitor zakończył się (kod {process.exitcode}), restart za {delay:.0f} s",
+                    event="restart", reason="watchdog" if hung else "crash", exitcode=process.exitcode)
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        # A second Ctrl+C must not cut the child's state saving short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if process is not None and process.is_alive():
+            stop_process(process)
+        log("🛑 Nadzorca zatrzymany")
 
-if __name__ == "__main__":
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    return (host or "127.0.0.1", int(port))
 
-    main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor dostępności i cen produktów")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="liczba procesów/maszyn sprawdzających (shardy według sklepu)")
+    parser.add_argument("--listen", type=parse_address, default=("127.0.0.1", 0),
+                        help="HOST:PORT koordynatora shardów")
+    parser.add_argument("--remote", action="store_true",
+                        help="nie uruchamiaj lokalnych shardów, czekaj na --worker z innych maszyn")
+    parser.add_argument("--worker", type=parse_address, metavar="HOST:PORT",
+                        help="uruchom jako shard podłączony do koordynatora")
+    parser.add_argument("--shard", type=int, default=0, help="numer shardu dla --worker")
+    parser.add_argument("--check-once", action="store_true",
+                        help="sprawdź wszystkie produkty raz i zakończ (cron, kontenery)")
+    parser.add_argument("--supervise", action="store_true",
+                        help="uruchom monitor w procesie potomnym i restartuj go po awarii, zawieszeniu "
+                             "lub przekroczeniu MEMORY_BUDGET_MB / HANDLE_BUDGET")
+    args = parser.parse_args()
+
+    authkey = os.getenv("SHARD_AUTHKEY")
+    authkey = authkey.encode("utf-8") if authkey else None
+    if (args.remote or args.worker) and not authkey:
+        parser.error("tryb rozproszony wymaga zmiennej SHARD_AUTHKEY")
+    if args.supervise and args.worker:
+        parser.error("--supervise dotyczy koordynatora, shardy restartuje on sam")
+
+    if args.worker:
+        run_shard_worker(args.worker, authkey, args.shard)
+    elif args.supervise:
+        supervise(shards=args.shards, listen=args.listen, authkey=authkey, remote=args.remote, once=args.check_once)
+    else:
+        main(args.shards, args.listen, authkey, args.remote, once=args.check_once)
 